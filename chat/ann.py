@@ -0,0 +1,179 @@
+"""
+Approximate nearest-neighbour index types for the main corpus.
+
+``CORPUS_INDEX_TYPE`` picks what ``build_index`` writes as ``index.faiss``:
+
+- ``flat``: exact search over every chunk (what the index was built with).
+- ``ivf_flat``: vectors clustered into ``nlist`` lists; a query scans the
+  ``nprobe`` nearest lists. Same memory as flat, much less work per query.
+- ``hnsw``: a navigable small-world graph (``hnsw_m`` links per vector);
+  fastest queries, more memory than flat, and chunks cannot be deleted.
+- ``ivf_pq``: IVF with vectors compressed by product quantisation into
+  ``pq_m`` codes of ``pq_bits`` bits; a fraction of the memory, lower recall.
+
+Independently, ``VECTOR_STORAGE`` stores the vectors of the flat, IVF and
+HNSW indexes (corpus and session uploads) as ``float32``, ``float16`` (half the
+memory) or ``int8`` (a quarter; scalar quantisation trained per dimension).
+Session indexes grow one upload at a time, too little to train int8 ranges
+on, so they use float16 when ``int8`` is asked for.
+
+The exact vectors are kept beside the served index (see ``corpus_index``) so
+incremental builds never re-train on compressed vectors.
+"""
+import math
+
+import numpy as np
+
+
+TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+STORAGE = ("float32", "float16", "int8")
+
+
+def _quantizer_type(vector_storage):
+    import faiss
+    return {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}[vector_storage]
+
+
+def index_type(index):
+    import faiss
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, (faiss.IndexIVFFlat, faiss.IndexIVFScalarQuantizer)):
+        return "ivf_flat"
+    if isinstance(index, (faiss.IndexFlat, faiss.IndexScalarQuantizer)):
+        return "flat"
+    return type(index).__name__
+
+
+def storage(index):
+    """How the vectors of ``index`` are stored: one of STORAGE, or None for PQ codes."""
+    import faiss
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return {faiss.ScalarQuantizer.QT_fp16: "float16", faiss.ScalarQuantizer.QT_8bit: "int8"}.get(index.sq.qtype)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return None
+    return "float32"
+
+
+def code_size(index):
+    """Bytes stored per vector."""
+    import faiss
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    return getattr(index, 'code_size', index.d * 4)
+
+
+def vectors(index):
+    """Every vector of ``index`` in position order (approximate for ``ivf_pq``)."""
+    import faiss
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def to_flat(index):
+    import faiss
+    flat = faiss.IndexFlat(index.d, index.metric_type)
+    flat.add(vectors(index))
+    return flat
+
+
+def _nlist(params, total):
+    # A common rule of thumb is about 4 * sqrt(N) lists; k-means wants at least
+    # 39 training vectors per list, so small corpora get fewer lists than asked for
+    return max(1, min(params.get('nlist') or int(4 * math.sqrt(total)), total // 39))
+
+
+def check(kind, params, vector_storage="float32", dim=None):
+    """Raise ValueError if ``build`` could not make a ``kind`` index with ``params``.
+
+    Called before anything is embedded, so a bad setting fails in seconds
+    rather than at the final save. ``dim`` is the embedding dimension.
+    """
+    if kind not in TYPES:
+        raise ValueError(f"Unknown index type {kind!r}; expected one of {', '.join(TYPES)}")
+    if vector_storage not in STORAGE:
+        raise ValueError(f"Unknown vector storage {vector_storage!r}; expected one of {', '.join(STORAGE)}")
+    for name in ('nlist', 'nprobe', 'hnsw_m', 'ef_construction', 'ef_search', 'train_size', 'pq_m', 'pq_bits'):
+        value = params.get(name)
+        if value is not None and (not isinstance(value, int) or value < 1):
+            raise ValueError(f"{name} must be a positive integer, not {value!r}")
+    if kind == "ivf_pq":
+        pq_m, pq_bits = params.get('pq_m', 48), params.get('pq_bits', 8)
+        if dim is not None and dim % pq_m:
+            raise ValueError(f"pq_m ({pq_m}) must divide the vector dimension ({dim})")
+        if pq_bits > 16:
+            raise ValueError(f"pq_bits ({pq_bits}) must be at most 16")
+
+
+def build(exact, kind, params, vector_storage="float32"):
+    """Return a ``kind`` index holding the vectors of the flat index ``exact``, in the same order.
+
+    Vectors are stored as ``vector_storage`` (PQ codes for ``ivf_pq``). Corpora
+    too small to train the requested index keep ``exact``.
+    """
+    import faiss
+    check(kind, params, vector_storage, exact.d)
+    if kind == "flat" and vector_storage == "float32":
+        return exact
+    data = np.ascontiguousarray(vectors(exact), dtype=np.float32)
+    total, d = data.shape
+    metric = exact.metric_type
+    sample = data
+    train_size = params.get('train_size', 100_000)
+    if total > train_size:
+        sample = data[np.random.default_rng(0).choice(total, train_size, replace=False)]
+
+    if kind == "flat":
+        index = faiss.IndexScalarQuantizer(d, _quantizer_type(vector_storage), metric)
+        index.train(sample)
+    elif kind == "hnsw":
+        if vector_storage == "float32":
+            index = faiss.IndexHNSWFlat(d, params.get('hnsw_m', 32), metric)
+        else:
+            index = faiss.IndexHNSWSQ(d, _quantizer_type(vector_storage), params.get('hnsw_m', 32), metric)
+            index.train(sample)
+        index.hnsw.efConstruction = params.get('ef_construction', 200)
+    else:
+        nlist = _nlist(params, total)
+        quantizer = faiss.IndexFlat(d, metric)
+        if kind == "ivf_pq":
+            pq_m, pq_bits = params.get('pq_m', 48), params.get('pq_bits', 8)
+            if total < 2 ** pq_bits:
+                print(f"Only {total} vectors, too few to train {pq_bits}-bit PQ codes; keeping a flat index")
+                return exact
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, pq_bits, metric)
+        elif vector_storage == "float32":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, metric)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, d, nlist, _quantizer_type(vector_storage), metric)
+        index.train(sample)
+    index.add(data)
+    configure(index, params)
+    return index
+
+
+def configure(index, params):
+    """Apply the query-time settings (``nprobe``, ``ef_search``) to a loaded index."""
+    import faiss
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(params.get('nprobe', 16), index.nlist)
+        # Pseudo-relevance feedback reads vectors back by position
+        index.make_direct_map()
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = params.get('ef_search', 64)
+    return index
+
+
+def memory_bytes(index):
+    import faiss
+    return int(faiss.serialize_index(index).nbytes)
@@ -0,0 +1,96 @@
+"""
+Conversation state (the standalone questions of each chat session).
+
+Histories live in a shared Django cache (``CONVERSATION_CACHE``, the database
+by default) so every worker sees the same history for a session. Each process
+keeps a bounded LRU copy whose entries are trusted for ``CONVERSATION_LOCAL_TTL``
+seconds; a chat turn takes longer than that, so every new turn re-reads the
+shared tier. When no shared cache is configured, or it is unavailable, the
+process-local tier is used on its own.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+_lock = threading.Lock()
+_local = OrderedDict()  # session_id -> (loaded_at, history), least recently used first
+_stats = {'local_hits': 0, 'shared_reads': 0, 'shared_errors': 0, 'evictions': 0}
+
+
+def _shared():
+    return caches[settings.CONVERSATION_CACHE] if settings.CONVERSATION_CACHE else None
+
+
+def _key(session_id):
+    return f"conversation:{session_id}"
+
+
+def _remember(session_id, history):
+    with _lock:
+        _local[session_id] = (time.monotonic(), history)
+        _local.move_to_end(session_id)
+        while len(_local) > settings.CONVERSATION_LOCAL_MAX_SESSIONS:
+            _local.popitem(last=False)
+            _stats['evictions'] += 1
+
+
+def _local_history(session_id, max_age):
+    with _lock:
+        entry = _local.get(session_id)
+        if entry is None:
+            return None
+        loaded_at, history = entry
+        if max_age is not None and time.monotonic() - loaded_at > max_age:
+            return None
+        _local.move_to_end(session_id)
+        return history
+
+
+def get_history(session_id):
+    """Return a copy of the session's history (oldest first)."""
+    shared = _shared()
+    history = _local_history(session_id, settings.CONVERSATION_LOCAL_TTL if shared else settings.CONVERSATION_TTL)
+    if history is not None:
+        _stats['local_hits'] += 1
+        return list(history)
+    if shared:
+        try:
+            history = shared.get(_key(session_id), [])
+            _stats['shared_reads'] += 1
+        except Exception as e:
+            print(f"Conversation store unavailable: {e}")
+            _stats['shared_errors'] += 1
+            history = _local_history(session_id, None) or []
+    else:
+        history = []
+    _remember(session_id, history)
+    return list(history)
+
+
+def append(session_id, *questions):
+    """Append ``questions`` to the session's history, trimming it to bounded length."""
+    history = get_history(session_id)
+    history.extend(questions)
+    if len(history) > settings.CONVERSATION_MAX_TURNS:
+        del history[0:4]
+    shared = _shared()
+    if shared:
+        try:
+            shared.set(_key(session_id), history, timeout=settings.CONVERSATION_TTL)
+        except Exception as e:
+            print(f"Conversation store unavailable: {e}")
+            _stats['shared_errors'] += 1
+    _remember(session_id, history)
+    return history
+
+
+def stats():
+    with _lock:
+        return {**_stats,
+                'local_sessions': len(_local),
+                'local_messages': sum(len(history) for _, history in _local.values()),
+                'local_chars': sum(len(q) for _, history in _local.values() for q in history)}
@@ -0,0 +1,201 @@
+"""
+Incremental builds of the main FAISS index (``manage.py build_index``).
+
+Every file under the source directory is hashed together with everything that
+shapes its chunks (see ``ingest.cache_config``); only files whose hash is not
+in the index's ``manifest.json`` are parsed (in parallel child processes, see
+``parsing``), embedded and added, and the chunks of a changed file replace its
+old ones. Files already in an index built elsewhere are recognised by their
+``source_id`` and recorded in the manifest without being embedded again.
+
+Progress is checkpointed to ``<index>.build`` after every batch of files, so an
+interrupted build resumes where it stopped. The finished index is written as
+``CORPUS_INDEX_TYPE`` (see ``ann``) and swapped in for the live one only at
+the end.
+"""
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.documents import Document
+
+from . import ann, ingest_cache, lexical, resources, source_metadata, swap
+from .embeddings import embed_chunks
+from .fusion import assign_chunk_ids
+from .ingest import cache_config
+from .parsing import Loader_map, extension, parse_files
+
+
+MANIFEST = "manifest.json"
+EXACT_INDEX = "exact.faiss"  # the flat index behind an approximate index.faiss
+
+
+def scan(directory):
+    """Paths of the supported files under ``directory``; each path is also the ``source`` its chunks cite."""
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names) if extension(name) in Loader_map)
+    return files
+
+
+def file_hash(path):
+    return ingest_cache.file_key(path, cache_config(*Loader_map[extension(path)]))
+
+
+def read_manifest(index_dir):
+    """``{source: {'hash': ..., 'ids': [docstore ids]}}`` for an index, empty if it has none."""
+    try:
+        with open(os.path.join(index_dir, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def load(index_dir):
+    """The index in ``index_dir`` with its exact (flat) vectors, and the ``(type, vector storage)`` it is served as.
+
+    Returns ``(None, None)`` if there is no index.
+    """
+    import faiss
+    from langchain_community.vectorstores import FAISS
+    swap.recover(index_dir)
+    if not os.path.exists(os.path.join(index_dir, "index.faiss")):
+        return None, None
+    store = FAISS.load_local(index_dir, embeddings=resources.get("embed_model"), allow_dangerous_deserialization=True)
+    served = (ann.index_type(store.index), ann.storage(store.index))
+    exact_path = os.path.join(index_dir, EXACT_INDEX)
+    if os.path.exists(exact_path):
+        store.index = faiss.read_index(exact_path)
+    elif served != ("flat", "float32"):
+        store.index = ann.to_flat(store.index)
+    return store, served
+
+
+def save(store, manifest, index_dir, kind="flat", params=None, with_lexical=False, vector_storage="float32"):
+    """Save ``store`` (holding a flat index) served as ``kind``, keeping the exact vectors beside it.
+
+    ``with_lexical`` also writes the BM25 index (see ``lexical``).
+    """
+    import faiss
+    # Write beside the old copy and swap, so a crash never leaves a half-written index
+    tmp_dir = swap.staging(index_dir)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    exact = store.index
+    served = ann.build(exact, kind, params or {}, vector_storage)
+    if served is exact:
+        store.save_local(tmp_dir)
+    else:
+        store.index = served
+        try:
+            store.save_local(tmp_dir)
+        finally:
+            store.index = exact
+        faiss.write_index(exact, os.path.join(tmp_dir, EXACT_INDEX))
+    with open(os.path.join(tmp_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+    if with_lexical:
+        lexical.build(store, tmp_dir)
+    swap.replace(index_dir)
+
+
+def adopt(store, manifest, hashes):
+    """Record files the index already holds (matched by ``source_id``) but the manifest does not know.
+
+    Returns the number of files adopted.
+    """
+    ids_by_source = {}
+    for doc_id, doc in store.docstore._dict.items():
+        ids_by_source.setdefault(source_metadata.source_id(doc.metadata.get("source", "")), []).append(doc_id)
+    known = {source_metadata.source_id(source) for source in manifest}
+    adopted = 0
+    for source, digest in hashes.items():
+        doc_source = source_metadata.source_id(source)
+        if source not in manifest and doc_source not in known and doc_source in ids_by_source:
+            manifest[source] = {'hash': digest, 'ids': ids_by_source[doc_source]}
+            adopted += 1
+    return adopted
+
+
+def build(directory, index_dir, processes, timeout, memory_mb=None, checkpoint_files=50, prune=False,
+          mapping=None, index_type="flat", index_params=None, vector_storage="float32", log=print):
+    """Bring ``index_dir`` up to date with ``directory`` and serve it as ``index_type``.
+
+    Returns ``(added, replaced, failed)`` file counts.
+    """
+    from langchain_community.vectorstores import FAISS
+    work_dir = f"{index_dir}.build"
+    store, _ = load(work_dir)
+    served = None
+    if store is not None:
+        manifest = read_manifest(work_dir)
+        log(f"Resuming the interrupted build in {work_dir}")
+    else:
+        store, served = load(index_dir)
+        manifest = read_manifest(index_dir)
+
+    files = scan(directory)
+    with ThreadPoolExecutor(max_workers=processes) as executor:
+        hashes = dict(zip(files, executor.map(file_hash, files)))
+    if store is not None:
+        adopted = adopt(store, manifest, hashes)
+        if adopted:
+            log(f"Recorded {adopted} files already in the index")
+
+    todo = [source for source in files if manifest.get(source, {}).get('hash') != hashes[source]]
+    removed = [source for source in manifest if source not in files] if prune else []
+    log(f"{len(files)} files, {len(todo)} new or changed" + (f", {len(removed)} removed" if prune else ""))
+    if (not todo and not removed and not os.path.exists(work_dir) and served in (None, (index_type, vector_storage if index_type != "ivf_pq" else None))
+            and (store is None or os.path.exists(lexical.path(index_dir)))):
+        return 0, 0, 0
+
+    added = replaced = failed = 0
+    if removed and store is not None:
+        store.delete([doc_id for source in removed for doc_id in manifest[source]['ids']])
+        for source in removed:
+            del manifest[source]
+
+    for offset in range(0, len(todo), checkpoint_files):
+        batch = todo[offset:offset + checkpoint_files]
+        results = parse_files([(source, source) for source in batch], processes=processes,
+                              timeout=timeout, memory_mb=memory_mb)
+        parsed = []
+        for source, (chunks, error) in zip(batch, results):
+            if error:
+                # Not recorded in the manifest, so the next build tries it again
+                log(f"Skipping {source}: {error}")
+                failed += 1
+                continue
+            parsed.append((source, [Document(page_content=content, metadata=metadata) for content, metadata in chunks]))
+
+        documents = [doc for _, docs in parsed for doc in docs]
+        if mapping is not None:
+            source_metadata.annotate(documents, mapping)
+        vectors = iter(embed_chunks([doc.page_content for doc in documents]))
+        for source, docs in parsed:
+            if source in manifest:
+                store.delete(manifest[source]['ids'])
+                replaced += 1
+            else:
+                added += 1
+            ids = assign_chunk_ids(docs)
+            text_embeddings = [(doc.page_content, next(vectors)) for doc in docs]
+            metadatas = [doc.metadata for doc in docs]
+            if store is None:
+                store = FAISS.from_embeddings(text_embeddings, resources.get("embed_model"), metadatas=metadatas, ids=ids)
+            else:
+                store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+            manifest[source] = {'hash': hashes[source], 'ids': ids}
+
+        # Checkpoints stay flat: only the finished index is worth training
+        if store is not None:
+            save(store, manifest, work_dir)
+        log(f"Checkpointed {min(offset + checkpoint_files, len(todo))}/{len(todo)} files")
+
+    if store is None:
+        return added, replaced, failed
+    log(f"Writing the {index_type} index ({vector_storage} vectors) to {index_dir}")
+    save(store, manifest, index_dir, index_type, index_params, with_lexical=True, vector_storage=vector_storage)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return added, replaced, failed
@@ -0,0 +1,190 @@
+"""
+Shared local embedding service (``manage.py embedding_server``).
+
+One process holds the embedding model; every web and ingestion worker sends
+its embed calls there instead of loading its own copy (``EMBEDDING_SERVER``).
+The server coalesces concurrent calls into micro-batches: the first waiting
+call opens a window of ``EMBED_SERVER_MAX_WAIT_MS`` during which calls from
+other connections join it, up to ``EMBED_BATCH_SIZE`` texts, and the batch
+goes to the model in one forward pass.
+
+Addresses are ``unix:/path/to.sock`` or ``host:port``. Messages are frames of
+a 4-byte big-endian length and a body: a request is a JSON object
+``{"texts": [...]}``; a reply is a JSON header (``{"n": rows, "d": dims}`` or
+``{"error": message}``) followed, on success, by a frame of float32 vectors.
+"""
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def parse_address(address):
+    """``(socket family, address)`` for ``unix:/path`` or ``host:port``."""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def _send(sock, body):
+    sock.sendall(struct.pack(">I", len(body)) + body)
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Embedding server closed the connection")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def _recv(sock):
+    (size,) = struct.unpack(">I", _recv_exact(sock, 4))
+    return _recv_exact(sock, size)
+
+
+class Batcher:
+    """Collects embed calls from many threads and runs them through ``model`` in micro-batches."""
+
+    def __init__(self, model, max_batch, max_wait):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = queue.Queue()
+        threading.Thread(target=self._loop, name="embed-batcher", daemon=True).start()
+
+    def embed(self, texts):
+        future = Future()
+        self.pending.put((texts, future))
+        return future.result()
+
+    def _loop(self):
+        while True:
+            calls = [self.pending.get()]
+            size = len(calls[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    call = self.pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                calls.append(call)
+                size += len(call[0])
+            self._run(calls)
+
+    def _run(self, calls):
+        texts = [text for call_texts, _ in calls for text in call_texts]
+        try:
+            vectors = np.asarray(self.model.embed_documents(texts), dtype=np.float32)
+        except Exception as e:
+            for _, future in calls:
+                future.set_exception(e)
+            return
+        offset = 0
+        for call_texts, future in calls:
+            future.set_result(vectors[offset:offset + len(call_texts)])
+            offset += len(call_texts)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = json.loads(_recv(self.request))
+            except (ConnectionError, OSError):
+                return
+            try:
+                vectors = self.server.batcher.embed(request['texts'])
+            except Exception as e:
+                _send(self.request, json.dumps({'error': f"{type(e).__name__}: {e}"}).encode())
+                continue
+            _send(self.request, json.dumps({'n': len(vectors), 'd': int(vectors.shape[1]) if len(vectors) else 0}).encode())
+            _send(self.request, np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(model, address, max_batch, max_wait):
+    """Serve ``model`` on ``address`` until interrupted."""
+    family, target = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(target):
+            os.remove(target)
+        server = _UnixServer(target, _Handler)
+    else:
+        server = _TCPServer(target, _Handler)
+    server.batcher = Batcher(model, max_batch, max_wait)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if family == socket.AF_UNIX and os.path.exists(target):
+            os.remove(target)
+
+
+class RemoteEmbeddings(Embeddings):
+    """``Embeddings`` served by ``embedding_server``; each thread keeps its own connection."""
+
+    def __init__(self, address, timeout=60):
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        family, target = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(target)
+        return sock
+
+    def _call(self, texts):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = self._local.sock = self._connect()
+        _send(sock, json.dumps({'texts': texts}).encode())
+        header = json.loads(_recv(sock))
+        if 'error' in header:
+            raise RuntimeError(f"Embedding server failed: {header['error']}")
+        data = _recv(sock)
+        return np.frombuffer(data, dtype=np.float32).reshape(header['n'], header['d'])
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        try:
+            vectors = self._call(list(texts))
+        except (ConnectionError, OSError):
+            # The server restarted or the connection went stale: retry once on a new one
+            self._close()
+            vectors = self._call(list(texts))
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
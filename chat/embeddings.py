@@ -0,0 +1,75 @@
+"""
+Bulk embedding for uploads and index builds.
+
+All chunks of a job are embedded together: they are ordered by length so each
+batch pads to similar sizes, sent to the model ``EMBED_BATCH_SIZE`` at a time,
+and returned in their original order.
+"""
+import time
+
+from django.conf import settings
+
+from . import resources
+
+
+def embed_chunks(texts, embed_model=None, progress=None):
+    """Embed ``texts`` in length-sorted batches; returns vectors in input order.
+
+    ``progress(done, total)`` is called after every batch.
+    """
+    embed_model = embed_model or resources.get("embed_model")
+    total = len(texts)
+    vectors = [None] * total
+    if not total:
+        return vectors
+
+    order = sorted(range(total), key=lambda i: len(texts[i]), reverse=True)
+    batch_size = settings.EMBED_BATCH_SIZE
+    start = time.perf_counter()
+    for offset in range(0, total, batch_size):
+        batch = order[offset:offset + batch_size]
+        for i, vector in zip(batch, embed_model.embed_documents([texts[i] for i in batch])):
+            vectors[i] = vector
+        if progress:
+            progress(min(offset + batch_size, total), total)
+
+    elapsed = time.perf_counter() - start
+    print(f"Embedded {total} chunks in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} chunks/sec)")
+    return vectors
+
+
+def load_model(backend, reduced=True, use_server=True):
+    """The embedding model on ``backend``: "torch" (sentence-transformers) or "onnx" (see ``onnx_embeddings``).
+
+    Both backends L2-normalise their vectors when ``EMBEDDING_NORMALIZE`` is set.
+    Unless ``reduced`` is False, vectors are cut to ``EMBEDDING_DIM`` (see ``reduction``).
+    With ``EMBEDDING_SERVER`` set (and ``use_server``), calls go to the shared
+    ``embedding_server`` process instead, which applies both settings itself.
+    """
+    if use_server and settings.EMBEDDING_SERVER:
+        from .embedding_server import RemoteEmbeddings
+        return RemoteEmbeddings(settings.EMBEDDING_SERVER)
+    if backend == "onnx":
+        from .onnx_embeddings import OnnxEmbeddings
+        model = OnnxEmbeddings(str(settings.EMBEDDING_ONNX_DIR), batch_size=settings.EMBED_BATCH_SIZE,
+                               threads=settings.EMBED_ONNX_THREADS, normalize=settings.EMBEDDING_NORMALIZE)
+    elif backend == "torch":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        configure_torch_threads()
+        model = HuggingFaceEmbeddings(model_name=settings.EMBEDDING_MODEL_ID, model_kwargs={'trust_remote_code': True},
+                                      encode_kwargs={'batch_size': settings.EMBED_BATCH_SIZE,
+                                                     'normalize_embeddings': settings.EMBEDDING_NORMALIZE})
+    else:
+        raise ValueError(f"Unknown embedding backend {backend!r}")
+    if reduced and settings.EMBEDDING_DIM:
+        from .reduction import Reducer, ReducedEmbeddings
+        reducer = Reducer.load(settings.EMBEDDING_DIM, settings.EMBEDDING_REDUCTION, settings.EMBEDDING_PCA_FILE)
+        model = ReducedEmbeddings(model, reducer)
+    return model
+
+
+def configure_torch_threads():
+    """Apply ``EMBED_TORCH_THREADS`` (None keeps torch's default of one thread per core)."""
+    if settings.EMBED_TORCH_THREADS:
+        import torch
+        torch.set_num_threads(settings.EMBED_TORCH_THREADS)
@@ -0,0 +1,86 @@
+"""
+Query expansion without an LLM call.
+
+``QUERY_EXPANSION`` picks how the question is widened before retrieval:
+
+- ``llm``: the model paraphrases the question (MultiQueryRetriever's prompt;
+  see ``views.expand_query``). The best coverage, one 70B call per question.
+- ``prf``: pseudo-relevance feedback. Each of the top corpus hits for the
+  question is mixed into the question vector (Rocchio), pulling in chunks
+  that resemble what already matched.
+- ``perturb``: the question vector nudged in random directions (seeded by
+  the question, so answers stay reproducible) to widen the neighbourhood.
+- ``paraphrase``: terms found in ``EXPANSION_PARAPHRASE_FILE`` (acronyms and
+  their spelled-out forms) are swapped in; the variants are embedded in one batch.
+- ``none``: the question alone.
+
+Every mode returns query vectors, the question's own first.
+"""
+import hashlib
+import json
+import re
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+
+from .vectors import normalise
+
+
+MODES = ("llm", "prf", "perturb", "paraphrase", "none")
+
+
+def expand(question, question_vector, mode, docsearch=None, embed_model=None):
+    """Query vectors for ``question`` under a local ``mode`` (anything but ``llm``)."""
+    q = np.asarray(question_vector, dtype=np.float32)
+    n = settings.EXPANSION_VARIANTS
+    if mode == "none":
+        variants = []
+    elif mode == "prf":
+        variants = feedback_vectors(q, docsearch, n)
+    elif mode == "perturb":
+        variants = perturbed_vectors(q, question, n)
+    elif mode == "paraphrase":
+        texts = paraphrases(question, n)
+        variants = embed_model.embed_documents(texts) if texts else []
+    else:
+        raise ValueError(f"Unknown query expansion {mode!r}; expected one of {', '.join(MODES)}")
+    return [question_vector] + [list(map(float, vector)) for vector in variants]
+
+
+def feedback_vectors(q, docsearch, n):
+    _, indices = docsearch.index.search(q[None, :], n)
+    hits = [int(i) for i in indices[0] if i != -1]
+    if not hits:
+        return []
+    documents = np.vstack([docsearch.index.reconstruct(i) for i in hits])
+    return normalise(q + settings.EXPANSION_PRF_WEIGHT * normalise(documents))
+
+
+def perturbed_vectors(q, question, n):
+    seed = int(hashlib.sha256(question.encode()).hexdigest()[:8], 16)
+    noise = normalise(np.random.default_rng(seed).standard_normal((n, q.shape[0])).astype(np.float32))
+    return normalise(q + settings.EXPANSION_NOISE * noise)
+
+
+@lru_cache(maxsize=None)
+def load_paraphrases(path):
+    """``[(pattern, alternatives)]`` from a JSON object of term -> list of alternatives."""
+    with open(path, encoding="utf8") as f:
+        table = json.load(f)
+    # Terms may contain punctuation ("M&E"), so match on non-word neighbours instead of \b.
+    # Acronyms only match in capitals, so "sow" or "pad" in running text is left alone
+    return [(re.compile(r"(?<!\w)" + re.escape(term) + r"(?!\w)", 0 if term.isupper() else re.IGNORECASE), alternatives)
+            for term, alternatives in table.items()]
+
+
+def paraphrases(question, n):
+    """Up to ``n`` rewrites of ``question`` with one known term replaced."""
+    variants = []
+    for pattern, alternatives in load_paraphrases(str(settings.EXPANSION_PARAPHRASE_FILE)):
+        if pattern.search(question):
+            for alternative in alternatives:
+                variant = pattern.sub(lambda _: alternative, question)
+                if variant not in variants and variant != question:
+                    variants.append(variant)
+    return variants[:n]
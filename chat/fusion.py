@@ -0,0 +1,62 @@
+"""
+Chunk identity and reciprocal rank fusion of ranked result lists.
+
+Every chunk gets a stable id when it is indexed: a hash of its ``source``, its
+position in that file and, for uploads, which file of which upload it came
+from (``chunk_id``). The id is the chunk's docstore id and is kept in its metadata,
+so merging results from several query vectors and indexes compares short
+strings instead of whole documents.
+
+A document scores ``sum(1 / (k + rank))`` over the lists it appears in, so
+agreement between retrievers outweighs a high rank in just one of them and no
+score calibration between retrievers is needed.
+"""
+import hashlib
+
+from django.conf import settings
+
+
+def chunk_id(source, offset, upload=None):
+    key = f"{source}\0{offset}" if upload is None else f"{upload}\0{source}\0{offset}"
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def assign_chunk_ids(documents, start=0, upload=None, part=0):
+    """Give consecutive chunks of one file their ids; ``start`` is the position of the first one.
+
+    ``upload`` (the ingestion job) and ``part`` (the file's position in it) tell
+    apart files with the same ``source``; ``upload`` is recorded in the metadata.
+    Returns the ids.
+    """
+    salt = None if upload is None else f"{upload}/{part}"
+    ids = []
+    for offset, doc in enumerate(documents, start):
+        doc.metadata['chunk_id'] = doc.id = chunk_id(doc.metadata.get('source'), offset, salt)
+        if upload is not None:
+            doc.metadata['upload'] = upload
+        ids.append(doc.id)
+    return ids
+
+
+def document_key(doc):
+    # Chunks indexed before chunk ids existed fall back to their docstore id, or the chunk itself
+    return doc.metadata.get('chunk_id') or doc.id or (doc.metadata.get('source'), doc.page_content)
+
+
+def reciprocal_rank_fusion(rankings, k=None, key=document_key, with_scores=False):
+    """Fuse ``rankings`` (lists of documents, best first) into one list, best first.
+
+    With ``with_scores`` the list holds ``(document, fused score)`` pairs.
+    """
+    k = settings.RRF_K if k is None else k
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            doc_key = key(doc)
+            documents.setdefault(doc_key, doc)
+            scores[doc_key] = scores.get(doc_key, 0.0) + 1.0 / (k + rank + 1)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    if with_scores:
+        return [(documents[doc_key], scores[doc_key]) for doc_key in ranked]
+    return [documents[doc_key] for doc_key in ranked]
@@ -0,0 +1,21 @@
+"""
+Past questions for the offline reports and benchmarks (``router_report`` and
+the ``benchmark_*`` commands).
+"""
+from django.db import connection
+
+
+def past_questions(limit, path=None):
+    """Up to ``limit`` distinct questions, newest first.
+
+    Read from ``path`` (one question per line) when given, otherwise from the
+    messages stored in ``Chat_history``.
+    """
+    if path:
+        with open(path) as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT message FROM Chat_history ORDER BY created_at DESC")
+            questions = [row[0].strip() for row in cursor.fetchall() if row[0] and row[0].strip()]
+    return list(dict.fromkeys(questions))[:limit]
@@ -0,0 +1,286 @@
+"""
+Background ingestion of uploaded files into a session's upload index.
+
+``upload_files`` only stores the files and records an ``IngestJob``; the job is
+then run either by ``manage.py ingest_worker`` (``INGEST_MODE = "worker"``,
+which claims queued jobs from the table) or on a small thread pool inside the
+web process (``INGEST_MODE = "thread"``). Files are parsed in child processes
+(see ``parsing``); with the thread pool, text, CSV, subtitle and PDF uploads
+are parsed straight from memory and never written to disk. Every file moves
+through the stages parsing -> splitting -> embedding -> indexing -> done (or failed), and the job
+row is updated at each step so ``upload_status`` can report progress. The
+chunks of all files in a job are embedded and indexed together; files seen
+before (see ``ingest_cache``) skip straight to indexing. CSV and Excel files
+are streamed instead: each batch of rows is embedded and indexed on its own.
+"""
+import os
+import re
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from langchain_core.documents import Document
+
+from . import ingest_cache, session_index
+from .embeddings import embed_chunks
+from .fusion import assign_chunk_ids
+from .models import IngestJob, IngestUpload
+from .parsing import Loader_map, MEMORY_FORMATS, SPLITTER_CONFIG, TABULAR_FORMATS, extension, iter_table_chunks, parse_files
+
+
+_executor = None
+_buffers = {}  # job_id -> {file position: bytes} for uploads kept in memory by INGEST_MODE = "thread"
+
+
+def cache_config(loader_class, loader_args):
+    # Everything besides the file's bytes that changes the chunks or their vectors
+    model = settings.EMBEDDING_MODEL_ID
+    if settings.EMBEDDING_BACKEND != "torch":
+        model = f"{model}:{settings.EMBEDDING_BACKEND}"
+    if not settings.EMBEDDING_NORMALIZE:
+        model = f"{model}:raw"
+    if settings.EMBEDDING_DIM:
+        model = f"{model}:{settings.EMBEDDING_REDUCTION}{settings.EMBEDDING_DIM}"
+    return {'loader': loader_class.__name__, 'loader_args': loader_args,
+            'splitter': SPLITTER_CONFIG, 'model': model}
+
+
+def submit(user, session_id, uploaded_files):
+    """Record the job and queue it, keeping the uploads in memory or under a job directory.
+
+    Formats that parse from bytes never touch the disk: with in-process
+    ingestion they stay in memory, and a separate worker process gets them from
+    the database (``IngestUpload``). Everything else is spilled to a uniquely
+    named file. ``run`` removes both once the job is over.
+    """
+    job_id = str(uuid.uuid4())
+    job_dir = os.path.join(settings.INGEST_DIR, job_id)
+    buffers = {}
+    files = []
+    for n, uploaded in enumerate(uploaded_files):
+        entry = {'name': uploaded.name, 'stage': 'queued', 'chunks': 0, 'error': None}
+        if extension(uploaded.name) not in Loader_map:
+            entry.update(stage='failed', error=f"Unsupported file type: {uploaded.name}")
+        elif extension(uploaded.name) in MEMORY_FORMATS and uploaded.size <= settings.INGEST_MEMORY_MAX_BYTES:
+            buffers[n] = b"".join(uploaded.chunks())
+            entry['in_memory'] = True
+        else:
+            # Prefix with the position so two uploads with the same name never collide
+            os.makedirs(job_dir, exist_ok=True)
+            safe_name = re.sub(r'[^A-Za-z0-9._-]', '_', os.path.basename(uploaded.name))
+            entry['path'] = os.path.join(job_dir, f"{n}-{safe_name}")
+            with open(entry['path'], 'wb') as destination:
+                for chunk in uploaded.chunks():
+                    destination.write(chunk)
+        files.append(entry)
+
+    job = IngestJob.objects.create(job_id=job_id, user=user, session_id=session_id, files=files)
+    if buffers and settings.INGEST_MODE != "thread":
+        IngestUpload.objects.bulk_create([IngestUpload(job=job, position=n, data=data) for n, data in buffers.items()])
+    elif buffers:
+        _buffers[job_id] = buffers
+    if settings.INGEST_MODE == "thread":
+        global _executor
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.INGEST_THREADS, thread_name_prefix="ingest")
+        _executor.submit(_run_in_thread, job.job_id)
+    return job
+
+
+def _run_in_thread(job_id):
+    try:
+        if claim(job_id):
+            run(job_id)
+    finally:
+        close_old_connections()
+
+
+def claim(job_id):
+    """Atomically move a queued job to running; False if another worker took it."""
+    return IngestJob.objects.filter(job_id=job_id, status='queued').update(status='running') == 1
+
+
+def run(job_id):
+    try:
+        _run(job_id)
+    except Exception as e:
+        # Never leave the job running: the upload form would poll it forever and a worker would retry it forever
+        print(f"Ingestion job {job_id} failed: {e}")
+        _fail(job_id, str(e))
+    finally:
+        _buffers.pop(job_id, None)
+        IngestUpload.objects.filter(job__job_id=job_id).delete()
+        shutil.rmtree(os.path.join(settings.INGEST_DIR, job_id), ignore_errors=True)
+
+
+def _fail(job_id, error):
+    """Mark the unfinished files of a job failed with ``error`` and close the job."""
+    try:
+        job = IngestJob.objects.get(job_id=job_id)
+        for entry in job.files:
+            if entry['stage'] not in ('done', 'failed'):
+                entry.update(stage='failed', error=error)
+        job.status = 'done' if any(entry['stage'] == 'done' for entry in job.files) else 'failed'
+        job.save(update_fields=['files', 'status', 'updated_at'])
+    except Exception as e:
+        print(f"Could not mark ingestion job {job_id} failed: {e}")
+
+
+def _run(job_id):
+    job = IngestJob.objects.get(job_id=job_id)
+    buffers = _buffers.get(job_id) or {upload.position: bytes(upload.data) for upload in job.uploads.all()}
+
+    def stage(entry, name, **fields):
+        entry.update(stage=name, **fields)
+        job.save(update_fields=['files', 'updated_at'])
+
+    parsed = []  # (entry, chunks, vectors or None, cache key) for every file that parsed and split
+    to_parse = []  # (entry, cache key, path or bytes, position) for files not in the cache
+    tables = []  # (entry, path or bytes, position) for CSV and Excel files, streamed in row batches
+    for n, entry in enumerate(job.files):
+        # A requeued job resumes with the files that had not finished
+        if entry['stage'] in ('done', 'failed'):
+            continue
+        try:
+            loader_class, loader_args = Loader_map[extension(entry['name'])]
+            config = cache_config(loader_class, loader_args)
+            if entry.get('in_memory'):
+                if n not in buffers:
+                    raise RuntimeError("The upload was lost when the server restarted; please upload it again")
+                source = buffers[n]
+            else:
+                source = entry['path']
+            if extension(entry['name']) in TABULAR_FORMATS:
+                tables.append((entry, source, n))
+                continue
+            if entry.get('in_memory'):
+                # Parsed by parsing.load_bytes rather than the format's loader
+                key = ingest_cache.content_key([source], {**config, 'loader': 'load_bytes'})
+            else:
+                key = ingest_cache.file_key(source, config)
+        except Exception as e:
+            stage(entry, 'failed', error=str(e))
+            continue
+        cached = ingest_cache.get(key)
+        if cached:
+            chunks, vectors = cached
+            texts = [Document(page_content=content, metadata={**metadata, 'source': entry['name']}) for content, metadata in chunks]
+            assign_chunk_ids(texts, upload=job.job_id, part=n)
+            entry.update(chunks=len(texts), cached=True)
+            parsed.append((entry, texts, vectors, key))
+        else:
+            entry['stage'] = 'parsing'
+            to_parse.append((entry, key, source, n))
+
+    # Parse the remaining files side by side, each in its own process with a time and memory limit
+    if to_parse:
+        job.save(update_fields=['files', 'updated_at'])
+        results = parse_files([(source, entry['name']) for entry, _, source, _ in to_parse],
+                              processes=settings.INGEST_PARSE_PROCESSES,
+                              timeout=settings.INGEST_PARSE_TIMEOUT,
+                              memory_mb=settings.INGEST_PARSE_MEMORY_MB,
+                              on_stage=lambda index, name: stage(to_parse[index][0], name))
+        for (entry, key, _, n), (chunks, error) in zip(to_parse, results):
+            if error:
+                print(f"Ingestion of {entry['name']} failed: {error}")
+                stage(entry, 'failed', error=error)
+                continue
+            texts = [Document(page_content=content, metadata=metadata) for content, metadata in chunks]
+            assign_chunk_ids(texts, upload=job.job_id, part=n)
+            entry['chunks'] = len(texts)
+            parsed.append((entry, texts, None, key))
+
+    # Chunks from all files are embedded together and indexed in one write
+    if parsed:
+        entries = [entry for entry, _, _, _ in parsed]
+        texts = [text for _, chunks, _, _ in parsed for text in chunks]
+        try:
+            for entry, _, vectors, _ in parsed:
+                entry['stage'] = 'embedding' if vectors is None else 'indexing'
+            job.save(update_fields=['files', 'updated_at'])
+            to_embed = [text for _, chunks, vectors, _ in parsed if vectors is None for text in chunks]
+            fresh = iter(embed_chunks([text.page_content for text in to_embed]))
+            vectors = []
+            for entry, chunks, cached_vectors, key in parsed:
+                if cached_vectors is None:
+                    file_vectors = [next(fresh) for _ in chunks]
+                    try:
+                        ingest_cache.put(key, [(text.page_content, text.metadata) for text in chunks], file_vectors)
+                    except OSError as e:
+                        print(f"Could not cache {entry['name']}: {e}")
+                else:
+                    file_vectors = list(cached_vectors)
+                vectors.extend(file_vectors)
+
+            for entry in entries:
+                entry['stage'] = 'indexing'
+            job.save(update_fields=['files', 'updated_at'])
+            session_index.add_embedded(job.session_id, texts, vectors)
+
+            for entry in entries:
+                entry['stage'] = 'done'
+        except Exception as e:
+            print(f"Indexing of job {job.job_id} failed: {e}")
+            for entry in entries:
+                entry.update(stage='failed', error=str(e))
+        job.save(update_fields=['files', 'updated_at'])
+
+    for entry, source, n in tables:
+        _ingest_table(job, entry, source, n, stage)
+
+    job.status = 'done' if any(entry['stage'] == 'done' for entry in job.files) else 'failed'
+    job.save(update_fields=['status', 'updated_at'])
+
+
+def _ingest_table(job, entry, source, part, stage):
+    """Stream a CSV or Excel file into the session index ``INGEST_TABLE_BATCH_ROWS`` rows at a time.
+
+    Each batch is embedded before the next is read, so memory stays flat however
+    large the sheet is. Every session index write rewrites the whole index, so
+    batches are indexed ``INGEST_TABLE_PERSIST_BATCHES`` at a time; a requeued
+    job skips the batches it had already indexed. Tables bypass ``ingest_cache``,
+    which needs every vector of a file at once.
+    """
+    documents, vectors = [], []
+
+    def flush(batches):
+        stage(entry, 'indexing')
+        session_index.add_embedded(job.session_id, documents, vectors)
+        stage(entry, 'parsing', chunks=entry['chunks'] + len(documents), batches=batches)
+        documents.clear()
+        vectors.clear()
+
+    try:
+        stage(entry, 'parsing')
+        batch = -1
+        for batch, chunks in enumerate(iter_table_chunks(source, entry['name'], settings.INGEST_TABLE_BATCH_ROWS)):
+            if batch < entry.get('batches', 0):
+                continue
+            stage(entry, 'embedding')
+            vectors.extend(embed_chunks([content for content, _ in chunks]))
+            batch_documents = [Document(page_content=content, metadata=metadata) for content, metadata in chunks]
+            # Positions continue across batches, so a resumed job gives every chunk the same id again
+            assign_chunk_ids(batch_documents, start=entry['chunks'] + len(documents), upload=job.job_id, part=part)
+            documents.extend(batch_documents)
+            if (batch + 1) % settings.INGEST_TABLE_PERSIST_BATCHES == 0:
+                flush(batch + 1)
+        if documents:
+            flush(batch + 1)
+        if not entry['chunks']:
+            raise ValueError("No text could be extracted from this file")
+        stage(entry, 'done')
+    except Exception as e:
+        print(f"Ingestion of {entry['name']} failed: {e}")
+        stage(entry, 'failed', error=str(e))
+
+
+def status(job):
+    return {
+        'job_id': job.job_id,
+        'session_id': job.session_id,
+        'status': job.status,
+        'files': [{key: entry.get(key) for key in ('name', 'stage', 'chunks', 'cached', 'error')} for entry in job.files],
+    }
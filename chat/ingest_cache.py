@@ -0,0 +1,106 @@
+"""
+Content-addressed cache of parsed chunks and their vectors for uploaded files.
+
+The key is the SHA-256 of the file's bytes plus everything that shapes the
+result (loader, splitter settings, embedding model), so uploading the same
+document again in any session skips parsing, splitting and embedding. Entries
+are pickles under ``INGEST_CACHE_DIR``; once the directory grows past
+``INGEST_CACHE_MAX_BYTES`` the least recently used entries are deleted.
+"""
+import hashlib
+import json
+import os
+import pickle
+import threading
+
+import numpy as np
+from django.conf import settings
+
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+
+def content_key(blocks, config):
+    digest = hashlib.sha256()
+    for block in blocks:
+        digest.update(block)
+    digest.update(json.dumps(config, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def file_key(path, config):
+    with open(path, 'rb') as f:
+        return content_key(iter(lambda: f.read(1 << 20), b''), config)
+
+
+def _entry_path(key):
+    return os.path.join(settings.INGEST_CACHE_DIR, f"{key}.pkl")
+
+
+def get(key):
+    """Return ``(chunks, vectors)`` for ``key`` or None. Chunks are ``(page_content, metadata)`` pairs."""
+    path = _entry_path(key)
+    try:
+        with open(path, 'rb') as f:
+            entry = pickle.load(f)
+        # Touch the entry so eviction sees it as recently used
+        os.utime(path)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        with _lock:
+            _stats['misses'] += 1
+        return None
+    with _lock:
+        _stats['hits'] += 1
+    return entry['chunks'], entry['vectors']
+
+
+def put(key, chunks, vectors):
+    os.makedirs(settings.INGEST_CACHE_DIR, exist_ok=True)
+    path = _entry_path(key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'chunks': chunks, 'vectors': np.asarray(vectors, dtype=np.float32)}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    with _lock:
+        _stats['stores'] += 1
+    _evict()
+
+
+def _entries():
+    try:
+        names = os.listdir(settings.INGEST_CACHE_DIR)
+    except OSError:
+        return []
+    entries = []
+    for name in names:
+        if name.endswith('.pkl'):
+            try:
+                st = os.stat(os.path.join(settings.INGEST_CACHE_DIR, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+    return entries
+
+
+def _evict():
+    entries = sorted(_entries())
+    used = sum(size for _, size, _ in entries)
+    for _, size, name in entries:
+        if used <= settings.INGEST_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(os.path.join(settings.INGEST_CACHE_DIR, name))
+        except OSError:
+            continue
+        used -= size
+        with _lock:
+            _stats['evictions'] += 1
+
+
+def stats():
+    entries = _entries()
+    with _lock:
+        lookups = _stats['hits'] + _stats['misses']
+        return {**_stats, 'hit_rate': round(_stats['hits'] / lookups, 3) if lookups else None,
+                'entries': len(entries), 'bytes': sum(size for _, size, _ in entries)}
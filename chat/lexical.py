@@ -0,0 +1,102 @@
+"""
+Lexical (BM25) search over the corpus with SQLite FTS5.
+
+Dense embeddings blur exact tokens such as document ids (``PN-AAJ-839``),
+acronyms (DQA, SOW, PMP) and indicator codes. ``build`` writes every chunk of
+a FAISS store into ``lexical.sqlite3`` beside ``index.faiss``, keyed by its
+docstore id, and ``LexicalIndex.search`` ranks chunks for a question with
+FTS5's BM25. ``-`` and ``_`` are kept inside tokens so hyphenated ids match
+as a whole, and stopwords are left out of queries so that a match means more
+than a shared "the".
+
+BM25 hits are what rescue exact-token questions, so ``identifiers`` picks out
+the tokens that dense search blurs (anything with a digit, ``-`` or ``_``, and
+all-caps acronyms); ``retrieval.select`` trusts a lexical hit regardless of its
+embedding only when it ``mentions`` one of them.
+"""
+import os
+import re
+import sqlite3
+import threading
+
+
+FILENAME = "lexical.sqlite3"
+
+_TOKEN = re.compile(r"[\w][\w\-]*", re.UNICODE)
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he her
+here hers herself him himself his how i if in into is it its itself just me more most my myself no nor not
+now of off on once only or other our ours ourselves out over own same she should so some such than that the
+their theirs them themselves then there these they this those through to too under until up very was we
+were what when where which while who whom why will with would you your yours yourself yourselves
+tell give explain describe please list
+""".split())
+
+
+def path(index_dir):
+    return os.path.join(index_dir, FILENAME)
+
+
+def build(store, index_dir):
+    """Write the lexical index for every chunk of ``store`` into ``index_dir``."""
+    db_path = path(index_dir)
+    tmp_path = f"{db_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    with sqlite3.connect(tmp_path) as conn:
+        conn.execute("CREATE VIRTUAL TABLE chunks USING fts5(doc_id UNINDEXED, content, "
+                     "tokenize = \"unicode61 tokenchars '-_'\")")
+        conn.executemany("INSERT INTO chunks (doc_id, content) VALUES (?, ?)",
+                         ((doc_id, doc.page_content) for doc_id, doc in store.docstore._dict.items()))
+    conn.close()
+    os.replace(tmp_path, db_path)
+
+
+def match_query(text):
+    # Quote every token so FTS5 never parses user text as query syntax
+    tokens = dict.fromkeys(token for token in map(str.lower, _TOKEN.findall(text)) if token not in STOPWORDS)
+    return " OR ".join('"' + token.replace('"', '""') + '"' for token in tokens)
+
+
+def identifiers(text):
+    """Lower-cased tokens of ``text`` that look like ids, codes or acronyms."""
+    return {token.lower() for token in _TOKEN.findall(text)
+            if any(c.isdigit() or c in "-_" for c in token) or (len(token) > 1 and token.isupper())}
+
+
+def mentions(text, terms):
+    """Whether ``text`` contains any of the lower-cased tokens ``terms``."""
+    return bool(terms) and not terms.isdisjoint(token.lower() for token in _TOKEN.findall(text))
+
+
+class LexicalIndex:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections are not shared between threads; each keeps its own read-only one
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+    def search(self, text, k):
+        """Docstore ids of the ``k`` best BM25 matches for ``text``, best first."""
+        query = match_query(text)
+        if not query:
+            return []
+        rows = self._connection().execute(
+            "SELECT doc_id FROM chunks WHERE chunks MATCH ? ORDER BY bm25(chunks) LIMIT ?", (query, k))
+        return [doc_id for doc_id, in rows]
+
+
+def load(index_dir):
+    """The lexical index built beside ``index_dir``, or None if there is none."""
+    db_path = path(index_dir)
+    if not os.path.exists(db_path):
+        return None
+    return LexicalIndex(db_path)
@@ -0,0 +1,86 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import resources
+from chat.embeddings import load_model
+from chat.history import past_questions
+
+
+class Command(BaseCommand):
+    help = ("Check ONNX embeddings against the torch model (norms, cosine agreement, top-k overlap on the index) "
+            "and compare their latency and throughput.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=100,
+                            help="Past questions from Chat_history used for query latency and parity")
+        parser.add_argument('--chunks', type=int, default=500,
+                            help="Corpus chunks used for throughput and parity")
+        parser.add_argument('--min-cosine', type=float, default=0.99,
+                            help="Fail if any vector agrees less than this with the torch vector")
+        parser.add_argument('--k', type=int, default=10,
+                            help="Corpus hits per question compared between the backends")
+        parser.add_argument('--min-overlap', type=float, default=0.9,
+                            help="Fail if the backends share less than this fraction of their top-k hits on average")
+
+    def handle(self, *args, **options):
+        questions = past_questions(options['queries'])
+        docsearch = resources.get("docsearch")
+        documents = list(docsearch.docstore._dict.values())
+        rng = np.random.default_rng(0)
+        picked = rng.choice(len(documents), min(options['chunks'], len(documents)), replace=False)
+        chunks = [documents[i].page_content for i in picked]
+        texts = questions + chunks
+        self.stdout.write(f"{len(questions)} questions, {len(chunks)} chunks")
+
+        vectors = {}
+        self.stdout.write(f"\n{'backend':<8} {'load s':>7} {'p50 ms':>8} {'p95 ms':>8} {'chunks/s':>9}")
+        for backend in ("torch", "onnx"):
+            start = time.perf_counter()
+            model = load_model(backend, use_server=False)
+            load_seconds = time.perf_counter() - start
+
+            latencies = []
+            for question in questions:
+                start = time.perf_counter()
+                model.embed_query(question)
+                latencies.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            model.embed_documents(chunks)
+            throughput = len(chunks) / (time.perf_counter() - start)
+            p50, p95 = (np.percentile(latencies, q) for q in (50, 95)) if latencies else (float('nan'),) * 2
+            self.stdout.write(f"{backend:<8} {load_seconds:>7.1f} {p50:>8.1f} {p95:>8.1f} {throughput:>9.1f}")
+
+            vectors[backend] = np.asarray(model.embed_documents(texts), dtype=np.float32)
+
+        torch_vectors, onnx_vectors = vectors["torch"], vectors["onnx"]
+        failures = []
+        self.stdout.write("")
+        for backend, backend_vectors in vectors.items():
+            norms = np.linalg.norm(backend_vectors, axis=1)
+            self.stdout.write(f"{backend} vector norms: min {norms.min():.4f}, max {norms.max():.4f}")
+            if settings.EMBEDDING_NORMALIZE and np.abs(norms - 1).max() > 1e-3:
+                failures.append(f"{backend} vectors are not unit length although EMBEDDING_NORMALIZE is set")
+
+        cosine = np.sum(torch_vectors * onnx_vectors, axis=1) / (
+            np.linalg.norm(torch_vectors, axis=1) * np.linalg.norm(onnx_vectors, axis=1))
+        self.stdout.write(f"Cosine agreement with torch: mean {cosine.mean():.4f}, "
+                          f"p1 {np.percentile(cosine, 1):.4f}, min {cosine.min():.4f}")
+        if cosine.min() < options['min_cosine']:
+            failures.append(f"ONNX vectors fall below {options['min_cosine']} cosine agreement")
+
+        if questions:
+            # What each backend's query vectors retrieve from the index actually being served
+            k = min(options['k'], docsearch.index.ntotal)
+            _, torch_hits = docsearch.index.search(np.ascontiguousarray(torch_vectors[:len(questions)]), k)
+            _, onnx_hits = docsearch.index.search(np.ascontiguousarray(onnx_vectors[:len(questions)]), k)
+            overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(torch_hits, onnx_hits)])
+            self.stdout.write(f"Top-{k} overlap on the existing index: {overlap:.3f}")
+            if overlap < options['min_overlap']:
+                failures.append(f"ONNX queries share only {overlap:.3f} of the torch top-{k} hits")
+
+        if failures:
+            raise CommandError("; ".join(failures) + "; keep EMBEDDING_BACKEND = 'torch'")
+        self.stdout.write("ONNX vectors agree with torch; EMBEDDING_BACKEND = 'onnx' is safe to use with the existing indexes")
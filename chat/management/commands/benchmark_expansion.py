@@ -0,0 +1,54 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat import expansion, fusion, resources, retrieval
+from chat.history import past_questions
+
+
+class Command(BaseCommand):
+    help = "Compare the query expansion modes with LLM expansion: overlap of the retrieved corpus chunks and latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help="Questions, one per line (default: past messages in Chat_history)")
+        parser.add_argument('--limit', type=int, default=50, help="Maximum number of questions")
+        parser.add_argument('--modes', nargs='+', choices=expansion.MODES, default=list(expansion.MODES))
+
+    def handle(self, *args, **options):
+        from chat.views import embed_queries, expand_query, search_corpus
+
+        questions = past_questions(options['limit'], options['file'])
+        if not questions:
+            self.stderr.write("No questions to expand.")
+            return
+        docsearch = resources.get("docsearch")
+        embed_model = resources.get("embed_model")
+        modes = options['modes'] if "llm" in options['modes'] else ["llm"] + options['modes']
+        k = settings.RETRIEVAL_MAX_DOCS
+
+        latencies = {mode: [] for mode in modes}
+        vector_counts = {mode: [] for mode in modes}
+        retrieved = {mode: [] for mode in modes}
+        for question in questions:
+            question_vector = embed_model.embed_query(question)
+            for mode in modes:
+                start = time.perf_counter()
+                if mode == "llm":
+                    vectors = embed_queries(expand_query(question), question_vector)
+                else:
+                    vectors = expansion.expand(question, question_vector, mode, docsearch=docsearch, embed_model=embed_model)
+                candidates = fusion.reciprocal_rank_fusion(search_corpus(vectors), key=retrieval.candidate_key)
+                documents = [doc for doc, _ in candidates[:k]]
+                latencies[mode].append((time.perf_counter() - start) * 1000)
+                vector_counts[mode].append(len(vectors))
+                retrieved[mode].append({fusion.document_key(doc) for doc in documents})
+
+        self.stdout.write(f"{len(questions)} questions, top {k} chunks, expansion + search latency\n")
+        self.stdout.write(f"{'mode':<11} {'queries':>7} {'p50 ms':>8} {'p95 ms':>8} {'overlap w/ llm':>15}")
+        for mode in modes:
+            overlap = np.mean([len(found & expected) / len(expected) if expected else 1.0
+                               for found, expected in zip(retrieved[mode], retrieved["llm"])])
+            self.stdout.write(f"{mode:<11} {np.mean(vector_counts[mode]):>7.1f} {np.percentile(latencies[mode], 50):>8.1f} "
+                              f"{np.percentile(latencies[mode], 95):>8.1f} {overlap:>15.1%}")
@@ -0,0 +1,56 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat import ann, corpus_index, resources
+from chat.history import past_questions
+
+
+class Command(BaseCommand):
+    help = "Compare recall@k, query latency and memory of the corpus index types against exact search."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index', default=str(settings.FAISS_INDEX_DIR))
+        parser.add_argument('--types', nargs='+', choices=ann.TYPES, default=list(ann.TYPES))
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--queries', type=int, default=200,
+                            help="Number of queries (past questions from Chat_history, topped up with corpus chunks)")
+
+    def handle(self, *args, **options):
+        store, served = corpus_index.load(options['index'])
+        if store is None:
+            self.stderr.write(f"No index in {options['index']}")
+            return
+        exact = store.index
+        k = options['k']
+        queries = self.load_queries(exact, options['queries'])
+        self.stdout.write(f"Index: {exact.ntotal} vectors of dimension {exact.d} (served as {served}); "
+                          f"{len(queries)} queries, k={k}")
+
+        _, truth = exact.search(queries, k)
+        self.stdout.write(f"\n{'type':<9} {'build s':>8} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8} {'memory MB':>10}")
+        for kind in options['types']:
+            start = time.perf_counter()
+            index = ann.build(exact, kind, settings.CORPUS_INDEX_PARAMS)
+            build_seconds = time.perf_counter() - start
+
+            latencies = []
+            found = np.empty_like(truth)
+            for i, query in enumerate(queries):
+                start = time.perf_counter()
+                _, ids = index.search(query[None, :], k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                found[i] = ids[0]
+            recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+            self.stdout.write(f"{kind:<9} {build_seconds:>8.1f} {recall:>9.3f} {np.percentile(latencies, 50):>8.2f} "
+                              f"{np.percentile(latencies, 95):>8.2f} {ann.memory_bytes(index) / 2 ** 20:>10.1f}")
+
+    def load_queries(self, exact, limit):
+        questions = past_questions(limit)
+        vectors = [np.asarray(v, dtype=np.float32) for v in resources.get("embed_model").embed_documents(questions)] if questions else []
+        if len(vectors) < limit:
+            sample = np.random.default_rng(0).choice(exact.ntotal, min(limit - len(vectors), exact.ntotal), replace=False)
+            vectors.extend(exact.reconstruct(int(i)) for i in sample)
+        return np.ascontiguousarray(np.vstack(vectors), dtype=np.float32)
@@ -0,0 +1,88 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat import ann, corpus_index, reduction
+from chat.embeddings import load_model
+from chat.history import past_questions
+
+
+class Command(BaseCommand):
+    help = "Compare reduced embedding dimensions and vector precisions against full float32 search (recall@k, latency, memory)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index', default=str(settings.FAISS_INDEX_DIR))
+        parser.add_argument('--dims', nargs='+', type=int, default=[768, 512, 384, 256, 128])
+        parser.add_argument('--methods', nargs='+', choices=["truncate", "pca"], default=["truncate", "pca"])
+        parser.add_argument('--storage', nargs='+', choices=ann.STORAGE, default=list(ann.STORAGE))
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--queries', type=int, default=200,
+                            help="Number of queries (past questions from Chat_history, topped up with corpus chunks)")
+        parser.add_argument('--save-pca', type=int, metavar='DIM',
+                            help="Save PCA components for EMBEDDING_DIM = DIM to EMBEDDING_PCA_FILE")
+
+    def handle(self, *args, **options):
+        import faiss
+
+        store, _ = corpus_index.load(options['index'])
+        if store is None:
+            self.stderr.write(f"No index in {options['index']}")
+            return
+        if settings.EMBEDDING_DIM:
+            self.stderr.write("EMBEDDING_DIM is set: the index already holds reduced vectors, so compare against a full-size index")
+        corpus = np.ascontiguousarray(ann.vectors(store.index), dtype=np.float32)
+        total, full_dim = corpus.shape
+        k = options['k']
+        queries = self.load_queries(corpus, options['queries'])
+        self.stdout.write(f"Index: {total} vectors of dimension {full_dim}; {len(queries)} queries, k={k}")
+
+        exact = faiss.IndexFlat(full_dim, store.index.metric_type)
+        exact.add(corpus)
+        _, truth = exact.search(queries, k)
+
+        sample = corpus
+        if total > 100_000:
+            sample = corpus[np.random.default_rng(0).choice(total, 100_000, replace=False)]
+        mean, components = reduction.fit_pca(sample, full_dim)
+        if options['save_pca']:
+            reduction.save_pca(settings.EMBEDDING_PCA_FILE, mean, components[:options['save_pca']])
+            self.stdout.write(f"Saved {options['save_pca']} PCA components to {settings.EMBEDDING_PCA_FILE}")
+
+        self.stdout.write(f"\n{'method':<9} {'dim':>5} {'storage':<8} {'recall@k':>9} {'p50 ms':>8} {'memory MB':>10}")
+        for method in options['methods']:
+            for dim in options['dims']:
+                if dim > full_dim:
+                    continue
+                if method == "truncate":
+                    reducer = reduction.Reducer(dim)
+                else:
+                    reducer = reduction.Reducer(dim, mean, components[:dim])
+                reduced_corpus = np.ascontiguousarray(reducer.transform(corpus))
+                reduced_queries = np.ascontiguousarray(reducer.transform(queries))
+                flat = faiss.IndexFlat(dim, store.index.metric_type)
+                flat.add(reduced_corpus)
+                for vector_storage in options['storage']:
+                    index = ann.build(flat, "flat", {}, vector_storage)
+                    latencies = []
+                    found = np.empty_like(truth)
+                    for i, query in enumerate(reduced_queries):
+                        start = time.perf_counter()
+                        _, ids = index.search(query[None, :], k)
+                        latencies.append((time.perf_counter() - start) * 1000)
+                        found[i] = ids[0]
+                    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+                    self.stdout.write(f"{method:<9} {dim:>5} {vector_storage:<8} {recall:>9.3f} "
+                                      f"{np.percentile(latencies, 50):>8.2f} {ann.memory_bytes(index) / 2 ** 20:>10.1f}")
+
+    def load_queries(self, corpus, limit):
+        questions = past_questions(limit)
+        vectors = []
+        if questions:
+            # Full-size query vectors, whatever EMBEDDING_DIM is
+            vectors = list(np.asarray(load_model(settings.EMBEDDING_BACKEND, reduced=False, use_server=False).embed_documents(questions), dtype=np.float32))
+        if len(vectors) < limit:
+            sample = np.random.default_rng(0).choice(len(corpus), min(limit - len(vectors), len(corpus)), replace=False)
+            vectors.extend(corpus[sample])
+        return np.ascontiguousarray(np.vstack(vectors), dtype=np.float32)
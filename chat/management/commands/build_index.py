@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import ann, corpus_index, resources, semantic_cache
+
+
+class Command(BaseCommand):
+    help = "Add new or changed documents from a directory to the FAISS index, resuming an interrupted build."
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help="Directory of source documents, searched recursively")
+        parser.add_argument('--index', default=str(settings.FAISS_INDEX_DIR))
+        parser.add_argument('--processes', type=int, default=settings.INGEST_PARSE_PROCESSES,
+                            help="Files parsed at the same time")
+        parser.add_argument('--checkpoint-files', type=int, default=50,
+                            help="Files indexed between checkpoints")
+        parser.add_argument('--prune', action='store_true',
+                            help="Also drop documents whose file no longer exists")
+        parser.add_argument('--index-type', choices=ann.TYPES, default=settings.CORPUS_INDEX_TYPE,
+                            help="Index written for serving (default: CORPUS_INDEX_TYPE)")
+        parser.add_argument('--vector-storage', choices=ann.STORAGE, default=settings.VECTOR_STORAGE,
+                            help="Precision of the served vectors (default: VECTOR_STORAGE)")
+
+    def handle(self, *args, **options):
+        # Fail on index settings faiss would reject before spending hours embedding
+        dim = len(resources.get("embed_model").embed_query("dimension"))
+        try:
+            ann.check(options['index_type'], settings.CORPUS_INDEX_PARAMS, options['vector_storage'], dim)
+        except ValueError as e:
+            raise CommandError(f"Invalid CORPUS_INDEX_PARAMS for {options['index_type']}: {e}")
+        try:
+            mapping = resources.get("source_metadata")
+        except Exception as e:
+            self.stderr.write(f"Not annotating titles and permalinks: {e}")
+            mapping = None
+        served = semantic_cache.corpus_version()
+        added, replaced, failed = corpus_index.build(
+            options['directory'], options['index'],
+            processes=options['processes'],
+            timeout=settings.INGEST_PARSE_TIMEOUT,
+            memory_mb=settings.INGEST_PARSE_MEMORY_MB,
+            checkpoint_files=options['checkpoint_files'],
+            prune=options['prune'],
+            mapping=mapping,
+            index_type=options['index_type'],
+            index_params=settings.CORPUS_INDEX_PARAMS,
+            vector_storage=options['vector_storage'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(f"Added {added} files, replaced {replaced}, {failed} failed")
+        if semantic_cache.corpus_version() != served:
+            # The index was swapped: answers cached by the web workers may cite what changed
+            semantic_cache.invalidate()
+        if added or replaced:
+            self.stdout.write("Restart the web workers to serve the new index")
@@ -0,0 +1,43 @@
+import os
+import shutil
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat import resources, semantic_cache, source_metadata, swap
+
+
+class Command(BaseCommand):
+    help = "Convert the DECfinder CSV into the compact source map, optionally writing titles into the FAISS docstore."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--csv', default=str(settings.SOURCE_METADATA_CSV))
+        parser.add_argument('--output', default=str(settings.SOURCE_METADATA_MAP))
+        parser.add_argument('--annotate-index', action='store_true',
+                            help="Store title/permalink in the metadata of every chunk of FAISS_INDEX_DIR")
+
+    def handle(self, *args, **options):
+        mapping = source_metadata.read_csv(options['csv'])
+        source_metadata.write_map(mapping, options['output'])
+        self.stdout.write(f"Wrote {len(mapping)} records to {options['output']}")
+
+        if options['annotate_index']:
+            docsearch = resources.get("docsearch")
+            documents = docsearch.docstore._dict.values()
+            matched = source_metadata.annotate(documents, mapping)
+            self.stdout.write(f"Annotated {matched} of {len(documents)} chunks")
+
+            # Save beside the live index and swap it in, so a crash never leaves a half-written index
+            index_dir = str(settings.FAISS_INDEX_DIR)
+            new_dir = swap.staging(index_dir)
+            shutil.rmtree(new_dir, ignore_errors=True)
+            docsearch.save_local(new_dir)
+            # Keep what build_index stores beside the FAISS files (manifest, exact vectors, lexical index)
+            for name in os.listdir(index_dir):
+                if not os.path.exists(os.path.join(new_dir, name)):
+                    shutil.copy2(os.path.join(index_dir, name), new_dir)
+            swap.replace(index_dir)
+            self.stdout.write(f"Saved annotated index to {index_dir}")
+
+        # Cached answers carry titles and permalinks from the old map
+        semantic_cache.invalidate()
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat import embedding_server
+from chat.embeddings import load_model
+
+
+class Command(BaseCommand):
+    help = "Serve the embedding model to every worker on one socket, batching concurrent calls together."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--address', default=settings.EMBEDDING_SERVER or f"unix:{settings.BASE_DIR / 'embedding.sock'}",
+                            help="unix:/path/to.sock or host:port (default: EMBEDDING_SERVER)")
+        parser.add_argument('--max-wait-ms', type=float, default=settings.EMBED_SERVER_MAX_WAIT_MS,
+                            help="How long a call waits for others to join its batch")
+        parser.add_argument('--max-batch', type=int, default=settings.EMBED_BATCH_SIZE,
+                            help="Texts per batch before it is sent without waiting")
+
+    def handle(self, *args, **options):
+        model = load_model(settings.EMBEDDING_BACKEND, use_server=False)
+        self.stdout.write(f"Serving {settings.EMBEDDING_MODEL_ID} ({settings.EMBEDDING_BACKEND}) on {options['address']}")
+        try:
+            embedding_server.serve(model, options['address'], options['max_batch'], options['max_wait_ms'] / 1000)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat import onnx_embeddings
+
+
+class Command(BaseCommand):
+    help = "Export the embedding model to an int8-quantised ONNX model for EMBEDDING_BACKEND = 'onnx'."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=settings.EMBEDDING_MODEL_ID)
+        parser.add_argument('--output', default=str(settings.EMBEDDING_ONNX_DIR))
+
+    def handle(self, *args, **options):
+        path = onnx_embeddings.export(options['model'], options['output'])
+        self.stdout.write(f"Wrote {path}")
+        self.stdout.write("Run `python manage.py benchmark_embeddings` to compare it with the torch model")
@@ -0,0 +1,51 @@
+import multiprocessing
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from chat import ingest
+from chat.models import IngestJob
+
+
+class Command(BaseCommand):
+    help = "Process queued upload ingestion jobs (INGEST_MODE = 'worker')."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help="Number of worker processes")
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+
+    def handle(self, *args, **options):
+        # Jobs left running by a worker that died are picked up again; run one
+        # ingest_worker command per deployment and scale it with --processes
+        requeued = IngestJob.objects.filter(status='running').update(status='queued')
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} interrupted jobs")
+
+        if options['processes'] <= 1:
+            work(options['once'])
+            return
+        # Children must not share the parent's database connection
+        connections.close_all()
+        workers = [multiprocessing.Process(target=work, args=(options['once'],)) for _ in range(options['processes'])]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+
+def work(once):
+    while True:
+        job_ids = list(IngestJob.objects.filter(status='queued').order_by('created_at').values_list('job_id', flat=True)[:10])
+        claimed = False
+        for job_id in job_ids:
+            if ingest.claim(job_id):
+                claimed = True
+                print(f"Ingesting job {job_id}")
+                ingest.run(job_id)
+                break
+        if not claimed:
+            if once:
+                return
+            time.sleep(settings.INGEST_POLL_SECONDS)
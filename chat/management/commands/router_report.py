@@ -0,0 +1,68 @@
+import json
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat import resources
+from chat.history import past_questions
+
+
+class Command(BaseCommand):
+    help = "Compare the local embedding router with the LLM router's labels on a set of questions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help="Questions to label, one per line (default: past messages in Chat_history)")
+        parser.add_argument('--limit', type=int, default=200, help="Maximum number of questions to label")
+        parser.add_argument('--save-exemplars', metavar='PATH',
+                            help="Merge the LLM-labelled questions into this exemplars JSON file")
+
+    def handle(self, *args, **options):
+        from chat.views import llm_route_agent
+
+        questions = past_questions(options['limit'], options['file'])
+        if not questions:
+            self.stderr.write("No questions to label.")
+            return
+
+        router = resources.get("agent_router")
+        vectors = resources.get("embed_model").embed_documents(questions)
+
+        rows = []
+        for question, vector in zip(questions, vectors):
+            expected = llm_route_agent(question)
+            predicted, margin = router.classify(vector)
+            rows.append((question, expected, predicted, margin))
+
+        total = len(rows)
+        agree = sum(expected == predicted for _, expected, predicted, _ in rows)
+        confident = [row for row in rows if row[3] >= settings.ROUTER_MIN_MARGIN]
+        confident_agree = sum(expected == predicted for _, expected, predicted, _ in confident)
+
+        self.stdout.write(f"Questions: {total}")
+        self.stdout.write(f"Top-1 agreement with LLM router: {agree / total:.1%}")
+        self.stdout.write(f"Answered locally (margin >= {settings.ROUTER_MIN_MARGIN}): {len(confident) / total:.1%}")
+        if confident:
+            self.stdout.write(f"Agreement when answered locally: {confident_agree / len(confident):.1%}")
+
+        self.stdout.write("\nConfusion (LLM label -> local label: count)")
+        for (expected, predicted), count in sorted(Counter((row[1], row[2]) for row in rows).items()):
+            marker = "" if expected == predicted else "  *"
+            self.stdout.write(f"  {expected:>13} -> {predicted:<13} {count}{marker}")
+
+        if options['save_exemplars']:
+            self.save_exemplars(options['save_exemplars'], rows)
+
+
+    def save_exemplars(self, path, rows):
+        exemplars = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                exemplars = json.load(f)
+        for question, expected, _, _ in rows:
+            if question not in exemplars.setdefault(expected, []):
+                exemplars[expected].append(question)
+        with open(path, 'w') as f:
+            json.dump(exemplars, f, indent=2)
+        self.stdout.write(f"\nSaved exemplars to {path}")
@@ -17,5 +17,30 @@ class Chat(models.Model):
 
     def __str__(self):
         return self.message
-    
-    
+
+
+class IngestJob(models.Model):
+    STATUS_CHOICES = [('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')]
+
+    job_id = models.CharField(max_length=100, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    session_id = models.CharField(max_length=100)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    # One entry per uploaded file: name, path, stage, chunks, error
+    files = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.job_id
+
+
+class IngestUpload(models.Model):
+    """The bytes of an upload parsed from memory, kept until an ``ingest_worker`` process has indexed it."""
+    job = models.ForeignKey(IngestJob, on_delete=models.CASCADE, related_name='uploads')
+    # Position of the file in IngestJob.files
+    position = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        unique_together = [('job', 'position')]
@@ -0,0 +1,85 @@
+"""
+int8-quantised ONNX Runtime backend for the embedding model.
+
+``export`` traces the Hugging Face model to ONNX (CLS pooling included, as in
+the sentence-transformers configuration of gte-multilingual-base), then
+quantises its weights to int8 with ONNX Runtime's dynamic quantisation. The
+tokenizer is saved alongside. ``OnnxEmbeddings`` serves the exported model
+through LangChain's ``Embeddings`` interface, so it is a drop-in replacement
+for ``HuggingFaceEmbeddings`` (``EMBEDDING_BACKEND = "onnx"``).
+"""
+import os
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+MODEL_FILE = "model_int8.onnx"
+
+
+def export(model_id, output_dir, opset=17):
+    """Export ``model_id`` to ``output_dir/model_int8.onnx``; returns the path."""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModel.from_pretrained(model_id, trust_remote_code=True).eval()
+
+    class ClsPooling(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state[:, 0]
+
+    sample = tokenizer(["An example sentence to trace the model"], return_tensors="pt")
+    fp32_path = os.path.join(output_dir, "model_fp32.onnx")
+    with torch.no_grad():
+        torch.onnx.export(ClsPooling(model), (sample["input_ids"], sample["attention_mask"]), fp32_path,
+                          input_names=["input_ids", "attention_mask"], output_names=["embedding"],
+                          dynamic_axes={"input_ids": {0: "batch", 1: "sequence"},
+                                        "attention_mask": {0: "batch", 1: "sequence"},
+                                        "embedding": {0: "batch"}},
+                          opset_version=opset)
+    path = os.path.join(output_dir, MODEL_FILE)
+    quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+    tokenizer.save_pretrained(output_dir)
+    return path
+
+
+class OnnxEmbeddings(Embeddings):
+    def __init__(self, model_dir, batch_size=32, max_length=8192, threads=None, normalize=True):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, MODEL_FILE), options,
+                                                    providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.normalize = normalize
+
+    def _embed(self, texts):
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+        (embedding,) = self.session.run(None, {"input_ids": encoded["input_ids"].astype(np.int64),
+                                               "attention_mask": encoded["attention_mask"].astype(np.int64)})
+        if not self.normalize:
+            return embedding
+        return embedding / np.linalg.norm(embedding, axis=1, keepdims=True)
+
+    def embed_documents(self, texts):
+        vectors = []
+        for offset in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed(texts[offset:offset + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
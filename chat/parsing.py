@@ -0,0 +1,287 @@
+"""
+Parsing and splitting of uploaded files in child processes.
+
+Each file is parsed in its own process (at most ``processes`` at a time), so a
+slow or pathological document can be killed after ``timeout`` seconds and a
+parser that balloons hits an address-space cap instead of taking the worker
+down. Failures are returned per file. CSV and Excel files are instead read
+row by row in the ingesting process (``iter_table_chunks``), so they never
+have to fit in memory.
+
+This module must stay importable without Django: children are started from a
+forkserver that preloads it.
+"""
+import csv
+import io
+import multiprocessing
+import multiprocessing.connection
+import time
+
+from langchain_community.document_loaders import (
+    CSVLoader,
+    EverNoteLoader,
+    PyMuPDFLoader,
+    TextLoader,
+    UnstructuredEmailLoader,
+    UnstructuredHTMLLoader,
+    UnstructuredMarkdownLoader,
+    UnstructuredEPubLoader,
+    UnstructuredODTLoader,
+    UnstructuredPowerPointLoader,
+    UnstructuredWordDocumentLoader,
+    UnstructuredExcelLoader,
+    UnstructuredImageLoader,
+    SRTLoader
+)
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+
+# Initialise loaders for Uploaded materials
+Loader_map={".csv":(CSVLoader, {}),
+            ".enex":  (EverNoteLoader,{}),
+            ".pdf":(PyMuPDFLoader,{}),
+            ".txt":(TextLoader,{"encoding":"utf8"}),
+            ".eml":(UnstructuredEmailLoader,{}),
+            ".html":(UnstructuredHTMLLoader,{}),
+            ".md":(UnstructuredMarkdownLoader,{}),
+            ".mmd":(UnstructuredMarkdownLoader,{}),
+            ".epub":(UnstructuredEPubLoader,{}),
+            ".odt":(UnstructuredODTLoader,{}),
+            ".pptx":(UnstructuredPowerPointLoader,{}),
+            ".ppt":(UnstructuredPowerPointLoader,{}),
+            ".doc":(UnstructuredWordDocumentLoader,{}),
+            ".docx":(UnstructuredWordDocumentLoader,{}),
+            ".xlsx":(UnstructuredExcelLoader,{}),
+            ".xls":(UnstructuredExcelLoader,{}),
+            ".jpg":(UnstructuredImageLoader,{}),
+            ".png":(UnstructuredImageLoader,{}),
+           ".srt":(SRTLoader,{})}
+
+SPLITTER_CONFIG = {'separators': ["\n\n", "\n"], 'chunk_size': 1000, 'chunk_overlap': 100}
+
+
+def extension(name):
+    return "." + name.rsplit(".", 1)[-1].lower()
+
+
+def text_splitter():
+    return RecursiveCharacterTextSplitter(**SPLITTER_CONFIG)
+
+
+# Formats read straight from the uploaded bytes; everything else needs a file on disk.
+# CSV bytes are streamed by iter_table_chunks, the rest are loaded by load_bytes
+MEMORY_FORMATS = {".txt", ".md", ".mmd", ".csv", ".srt", ".pdf"}
+
+
+def load_bytes(data, name):
+    """Documents for an upload held in memory (``extension(name)`` in MEMORY_FORMATS)."""
+    ext = extension(name)
+    if ext == ".pdf":
+        import fitz
+        with fitz.open(stream=data, filetype="pdf") as pdf:
+            return [Document(page_content=page.get_text(), metadata={'source': name, 'page': number, 'total_pages': len(pdf)})
+                    for number, page in enumerate(pdf)]
+    text = data.decode("utf8")
+    if ext == ".srt":
+        # Keep the subtitle text, drop cue numbers and timestamps
+        lines = [line.strip() for line in text.splitlines()]
+        text = " ".join(line for line in lines if line and not line.isdigit() and "-->" not in line)
+    return [Document(page_content=text, metadata={'source': name})]
+
+
+# Spreadsheets are streamed in row batches (iter_table_chunks) instead of going through parse_files
+TABULAR_FORMATS = {".csv", ".xlsx", ".xls"}
+
+
+def iter_rows(source, name):
+    """Yield ``(sheet, row number, {column: value})`` for every row of a CSV or Excel file.
+
+    Rows are read one at a time; ``source`` is a path or the file's bytes. The
+    first row of each sheet is its header. ``sheet`` is None for CSV files.
+    """
+    ext = extension(name)
+    if ext == ".csv":
+        raw = io.BytesIO(source) if isinstance(source, bytes) else open(source, 'rb')
+        with io.TextIOWrapper(raw, encoding="utf8", newline="") as f:
+            for number, row in enumerate(csv.DictReader(f)):
+                yield None, number, row
+    elif ext == ".xlsx":
+        import openpyxl
+        workbook = openpyxl.load_workbook(io.BytesIO(source) if isinstance(source, bytes) else source, read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                rows = sheet.iter_rows(values_only=True)
+                header = _header(next(rows, None) or [])
+                for number, values in enumerate(rows):
+                    yield sheet.title, number, dict(zip(header, values))
+        finally:
+            workbook.close()
+    else:
+        # .xls is capped at 65536 rows a sheet, so xlrd loading a sheet at a time stays bounded
+        import xlrd
+        if isinstance(source, bytes):
+            workbook = xlrd.open_workbook(file_contents=source, on_demand=True)
+        else:
+            workbook = xlrd.open_workbook(source, on_demand=True)
+        try:
+            for index in range(workbook.nsheets):
+                sheet = workbook.sheet_by_index(index)
+                if sheet.nrows:
+                    header = _header(sheet.row_values(0))
+                    for number in range(1, sheet.nrows):
+                        yield sheet.name, number - 1, dict(zip(header, sheet.row_values(number)))
+                workbook.unload_sheet(index)
+        finally:
+            workbook.release_resources()
+
+
+def _header(cells):
+    return [str(cell).strip() if cell not in (None, "") else f"column {i + 1}" for i, cell in enumerate(cells)]
+
+
+def row_text(row):
+    # Same "column: value" lines as CSVLoader, leaving out empty cells
+    return "\n".join(f"{key}: {str(value).strip()}" for key, value in row.items()
+                     if key is not None and value not in (None, "") and str(value).strip())
+
+
+def iter_table_chunks(source, name, batch_rows):
+    """Yield lists of ``(page_content, metadata)`` chunks, one list per ``batch_rows`` rows.
+
+    Consecutive rows of a sheet are grouped into chunks of up to the splitter's
+    ``chunk_size``; a single row longer than that is split on its own. Only one
+    batch is held in memory at a time.
+    """
+    chunk_size = SPLITTER_CONFIG['chunk_size']
+    splitter = text_splitter()
+    chunks, group = [], []
+    group_length = 0
+    current_sheet = None
+
+    def metadata(sheet, number):
+        return {'source': name, 'row': number} if sheet is None else {'source': name, 'sheet': sheet, 'row': number}
+
+    def close_group():
+        nonlocal group_length
+        if group:
+            chunks.append(("\n\n".join(text for _, text in group), metadata(current_sheet, group[0][0])))
+            group.clear()
+            group_length = 0
+
+    rows = 0
+    for sheet, number, row in iter_rows(source, name):
+        if sheet != current_sheet:
+            close_group()
+            current_sheet = sheet
+        text = row_text(row)
+        if text:
+            if len(text) > chunk_size:
+                close_group()
+                chunks.extend((piece, metadata(sheet, number)) for piece in splitter.split_text(text))
+            else:
+                if group and group_length + len(text) > chunk_size:
+                    close_group()
+                group.append((number, text))
+                group_length += len(text) + 2
+        rows += 1
+        if rows % batch_rows == 0:
+            close_group()
+            if chunks:
+                yield list(chunks)
+                chunks.clear()
+    close_group()
+    if chunks:
+        yield chunks
+
+
+def parse_file(source, name, on_stage=None):
+    """Load and split one file; returns ``(page_content, metadata)`` pairs citing ``name``.
+
+    ``source`` is either a path or, for MEMORY_FORMATS, the file's bytes.
+    """
+    if isinstance(source, bytes):
+        document = load_bytes(source, name)
+    else:
+        loader_class, loader_args = Loader_map[extension(name)]
+        document = loader_class(source, **loader_args).load()
+    if on_stage:
+        on_stage('splitting')
+    texts = text_splitter().split_documents(document)
+    if not texts:
+        raise ValueError("No text could be extracted from this file")
+    # Cite the uploaded file's own name, not its temporary path
+    return [(text.page_content, {**text.metadata, 'source': name}) for text in texts]
+
+
+def _parse_in_child(conn, source, name, memory_mb):
+    try:
+        if memory_mb:
+            import resource
+            limit = memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        chunks = parse_file(source, name, on_stage=lambda stage: conn.send(('stage', stage)))
+        conn.send(('ok', chunks))
+    except MemoryError:
+        conn.send(('error', f"Parsing needed more than {memory_mb} MB of memory"))
+    except Exception as e:
+        conn.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+_context = None
+
+
+def _get_context():
+    global _context
+    if _context is None:
+        _context = multiprocessing.get_context("forkserver")
+        _context.set_forkserver_preload([__name__])
+    return _context
+
+
+def parse_files(files, processes, timeout, memory_mb=None, on_stage=None):
+    """Parse ``files`` (``(path or bytes, name)`` pairs) in parallel child processes.
+
+    Returns one ``(chunks, error)`` pair per file, in order; exactly one of the
+    two is None. ``on_stage(index, stage)`` reports when a file moves on to
+    splitting.
+    """
+    ctx = _get_context()
+    results = [None] * len(files)
+    pending = list(enumerate(files))
+    running = {}  # index -> (process, connection, started)
+
+    while pending or running:
+        while pending and len(running) < processes:
+            index, (source, name) = pending.pop(0)
+            receiver, sender = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=_parse_in_child, args=(sender, source, name, memory_mb), daemon=True)
+            process.start()
+            sender.close()
+            running[index] = (process, receiver, time.monotonic())
+
+        ready = multiprocessing.connection.wait([conn for _, conn, _ in running.values()], timeout=0.5)
+        now = time.monotonic()
+        for index, (process, conn, started) in list(running.items()):
+            if conn in ready:
+                try:
+                    kind, payload = conn.recv()
+                except EOFError:
+                    process.join()
+                    kind, payload = 'error', f"Parser exited unexpectedly (exit code {process.exitcode})"
+                if kind == 'stage':
+                    if on_stage:
+                        on_stage(index, payload)
+                    continue
+                results[index] = (payload, None) if kind == 'ok' else (None, payload)
+            elif now - started > timeout:
+                process.kill()
+                results[index] = (None, f"Parsing took longer than {timeout} seconds")
+            else:
+                continue
+            process.join()
+            conn.close()
+            del running[index]
+    return results
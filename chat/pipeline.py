@@ -0,0 +1,84 @@
+"""
+Dependency-graph runner for the chat pipeline.
+
+Each stage names the stages it depends on; a stage is submitted to a shared
+thread pool as soon as all of its dependencies have finished, so independent
+LLM calls overlap and the wall time of a request tracks its critical path.
+"""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            # Two first requests must not each start a pool
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.PIPELINE_MAX_WORKERS, thread_name_prefix="chat-pipeline")
+    return _executor
+
+
+class Stage:
+    """A named step: ``fn`` is called with the results of ``deps`` as keyword arguments."""
+
+    def __init__(self, name, fn, deps=()):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+
+
+def run(stages, initial=None):
+    """Run ``stages`` respecting their dependencies and return ``{name: result}``.
+
+    ``initial`` seeds results that stages can depend on without computing them.
+    The first stage to raise cancels everything not yet started and re-raises.
+    """
+    results = dict(initial or {})
+    timings = {}
+    pending = {stage.name: stage for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in pending and dep not in results]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages {missing}")
+
+    executor = get_executor()
+    running = {}
+
+    def submit_ready():
+        for name, stage in list(pending.items()):
+            if all(dep in results for dep in stage.deps):
+                del pending[name]
+                kwargs = {dep: results[dep] for dep in stage.deps}
+                running[executor.submit(_timed, stage.fn, kwargs)] = name
+
+    submit_ready()
+    while running:
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = running.pop(future)
+            try:
+                results[name], timings[name] = future.result()
+            except Exception:
+                for other in running:
+                    other.cancel()
+                raise
+        submit_ready()
+
+    if pending:
+        raise ValueError(f"Stages {sorted(pending)} have unsatisfiable dependencies")
+    print("Stage timings: " + ", ".join(f"{name}={seconds:.2f}s" for name, seconds in timings.items()))
+    return results
+
+
+def _timed(fn, kwargs):
+    start = time.perf_counter()
+    value = fn(**kwargs)
+    return value, time.perf_counter() - start
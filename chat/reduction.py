@@ -0,0 +1,72 @@
+"""
+Smaller embedding vectors: keep fewer dimensions of every vector.
+
+With ``EMBEDDING_DIM`` set, every embedding the app computes (queries, uploads,
+corpus builds, the semantic cache and the router) is reduced to that many
+dimensions and normalised again:
+
+- ``truncate`` keeps the leading dimensions. gte-multilingual-base is trained
+  so that its leading dimensions (down to 128) still work as an embedding.
+- ``pca`` projects onto principal components fitted on the corpus vectors
+  (``manage.py benchmark_reduction --save-pca``), stored in ``EMBEDDING_PCA_FILE``.
+
+Indexes built with another dimension cannot be searched with reduced vectors:
+run ``build_index`` again and clear ``SESSION_INDEX_DIR`` after changing it.
+"""
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class Reducer:
+    def __init__(self, dim, mean=None, components=None):
+        self.dim = dim
+        self.mean = mean
+        self.components = components
+
+    @classmethod
+    def load(cls, dim, method, pca_file=None):
+        if method == "truncate":
+            return cls(dim)
+        if method != "pca":
+            raise ValueError(f"Unknown reduction {method!r}; expected 'truncate' or 'pca'")
+        fitted = np.load(pca_file)
+        if fitted['components'].shape[0] < dim:
+            raise ValueError(f"{pca_file} holds {fitted['components'].shape[0]} components, fewer than EMBEDDING_DIM ({dim})")
+        return cls(dim, fitted['mean'], fitted['components'][:dim])
+
+    def transform(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.components is None:
+            reduced = vectors[:, :self.dim]
+        else:
+            reduced = (vectors - self.mean) @ self.components.T
+        norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+        return reduced / np.where(norms == 0, 1, norms)
+
+
+def fit_pca(vectors, dim):
+    """``(mean, components)`` of the top ``dim`` principal components of ``vectors``."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    mean = vectors.mean(axis=0)
+    _, _, components = np.linalg.svd(vectors - mean, full_matrices=False)
+    return mean, components[:dim]
+
+
+def save_pca(path, mean, components):
+    np.savez(path, mean=mean, components=components)
+
+
+class ReducedEmbeddings(Embeddings):
+    """Embeddings from ``model`` passed through ``reducer``."""
+
+    def __init__(self, model, reducer):
+        self.model = model
+        self.reducer = reducer
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return self.reducer.transform(self.model.embed_documents(texts)).tolist()
+
+    def embed_query(self, text):
+        return self.reducer.transform([self.model.embed_query(text)])[0].tolist()
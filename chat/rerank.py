@@ -0,0 +1,29 @@
+"""
+Local relevance scoring of retrieved chunks with a cross-encoder.
+
+The LLM grader (``views.grade_documents``) asks the model about one chunk at a
+time. A cross-encoder reads the question and a chunk together and scores how
+well the chunk answers it; the whole fused pool is scored in one batch on the
+CPU, the best ``RERANK_TOP_N`` are kept, and their scores replace the fused
+ones when ``retrieval.select`` picks the context.
+
+Scores go through a sigmoid, so they lie in [0, 1] whatever the model, and
+``RERANK_MIN_SCORE`` reads as a probability of relevance.
+"""
+import numpy as np
+
+
+def load(model_id, max_length=512):
+    import torch
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(model_id, device="cpu", max_length=max_length, activation_fn=torch.nn.Sigmoid())
+
+
+def rerank(model, question, texts, top_n, min_score=None):
+    """``(position, score)`` for at most ``top_n`` of ``texts``, best first, leaving out any scoring below ``min_score``."""
+    if not texts:
+        return []
+    pairs = [(question, text) for text in texts]
+    scores = np.asarray(model.predict(pairs, batch_size=len(pairs), show_progress_bar=False), dtype=np.float32)
+    order = np.argsort(-scores, kind="stable")[:top_n]
+    return [(int(i), float(scores[i])) for i in order if min_score is None or scores[i] >= min_score]
@@ -0,0 +1,188 @@
+"""
+Process-wide registry for the heavy objects the chat views depend on
+(Groq clients, the embedding model, the FAISS corpus, the reranker and the source metadata).
+
+Nothing is loaded at import time. A resource is built the first time it is
+requested with ``get`` or during an explicit ``warmup``; every load is timed so
+``/healthz`` and ``/readyz`` can report what a worker has loaded.
+"""
+import os
+import threading
+import time
+
+from django.conf import settings
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+_loaders = {}
+_required = set()
+_resources = {}
+_timings = {}
+_errors = {}
+_failures = {}  # name -> (exception, consecutive failures, time of the last attempt)
+_locks = {}
+_registry_lock = threading.Lock()
+_warmup_thread = None
+
+
+def register(name, loader, required=True):
+    """Register a zero-argument ``loader`` under ``name``.
+
+    Required resources must be loaded before the worker reports ready.
+    """
+    with _registry_lock:
+        _loaders[name] = loader
+        _locks[name] = threading.Lock()
+        if required:
+            _required.add(name)
+        else:
+            _required.discard(name)
+
+
+def _retry_delay(failures):
+    return min(settings.RESOURCE_RETRY_SECONDS * 2 ** (failures - 1), settings.RESOURCE_RETRY_MAX_SECONDS)
+
+
+def get(name):
+    """Return the resource, loading it on first use.
+
+    After a failed load the same error is raised again, without calling the
+    loader, until the retry delay (see ``RESOURCE_RETRY_SECONDS``) has passed.
+    """
+    try:
+        return _resources[name]
+    except KeyError:
+        pass
+    with _locks[name]:
+        # Another thread may have finished the load while we waited
+        if name in _resources:
+            return _resources[name]
+        if name in _failures:
+            error, failures, failed_at = _failures[name]
+            if time.monotonic() - failed_at < _retry_delay(failures):
+                raise error
+        start = time.perf_counter()
+        try:
+            value = _loaders[name]()
+        except Exception as e:
+            _errors[name] = repr(e)
+            failures = _failures[name][1] + 1 if name in _failures else 1
+            _failures[name] = (e, failures, time.monotonic())
+            raise
+        _timings[name] = time.perf_counter() - start
+        _errors.pop(name, None)
+        _failures.pop(name, None)
+        _resources[name] = value
+        print(f"Loaded {name} in {_timings[name]:.2f}s")
+        return value
+
+
+def is_loaded(name):
+    return name in _resources
+
+
+def lazy_runnable(name):
+    """Runnable stand-in for a registered model, usable when composing chains.
+
+    The underlying model is resolved on the first invoke/stream, so chains can
+    be declared at import time without loading anything.
+    """
+    from langchain_core.runnables import RunnableLambda
+    # RunnableLambda invokes (or streams) a returned Runnable with the same input
+    return RunnableLambda(lambda _input: get(name), name=name)
+
+
+def warmup(names=None):
+    """Load ``names`` (default: every registered resource) in registration order."""
+    for name in names or list(_loaders):
+        try:
+            get(name)
+        except Exception as e:
+            print(f"Warmup failed for {name}: {e}")
+
+
+def start_warmup():
+    """Run ``warmup`` on a daemon thread so the server can answer probes meanwhile."""
+    global _warmup_thread
+    with _registry_lock:
+        if _warmup_thread is not None:
+            return _warmup_thread
+        _warmup_thread = threading.Thread(target=warmup, name="resource-warmup", daemon=True)
+        _warmup_thread.start()
+    return _warmup_thread
+
+
+def is_ready():
+    return all(name in _resources for name in _required)
+
+
+def status():
+    return {
+        name: {
+            'loaded': name in _resources,
+            'required': name in _required,
+            'load_seconds': round(_timings[name], 3) if name in _timings else None,
+            'error': _errors.get(name),
+        }
+        for name in _loaders
+    }
+
+
+# Loaders
+
+def _groq(model):
+    def load():
+        from langchain_groq import ChatGroq
+        if not os.getenv("GROQ_API_KEY"):
+            raise RuntimeError("GROQ_API_KEY is not set")
+        return ChatGroq(model=model, temperature=0)
+    return load
+
+
+def _load_embed_model():
+    from .embeddings import load_model
+    return load_model(settings.EMBEDDING_BACKEND)
+
+
+def _load_docsearch():
+    from langchain_community.vectorstores import FAISS
+    from . import ann, swap
+    # A build_index or build_source_metadata run that crashed mid-swap would leave no index here
+    swap.recover(str(settings.FAISS_INDEX_DIR))
+    docsearch = FAISS.load_local(str(settings.FAISS_INDEX_DIR), embeddings=get("embed_model"), allow_dangerous_deserialization=True)
+    ann.configure(docsearch.index, settings.CORPUS_INDEX_PARAMS)
+    return docsearch
+
+
+def _load_lexical():
+    from . import lexical
+    return lexical.load(str(settings.FAISS_INDEX_DIR))
+
+
+def _load_reranker():
+    if settings.RELEVANCE_FILTER != "cross_encoder":
+        return None
+    from . import rerank
+    return rerank.load(settings.RERANK_MODEL_ID)
+
+
+def _load_source_metadata():
+    from . import source_metadata
+    return source_metadata.load(settings.SOURCE_METADATA_MAP, settings.SOURCE_METADATA_CSV)
+
+
+def _load_agent_router():
+    from .router import CentroidRouter, load_exemplars
+    return CentroidRouter(get("embed_model"), load_exemplars())
+
+
+register("g_llm", _groq("llama-3.3-70b-versatile"))
+register("llm", _groq("llama-3.1-8b-instant"))
+register("embed_model", _load_embed_model)
+register("docsearch", _load_docsearch)
+register("lexical", _load_lexical, required=False)
+register("reranker", _load_reranker, required=False)
+register("source_metadata", _load_source_metadata)
+register("agent_router", _load_agent_router, required=False)
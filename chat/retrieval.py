@@ -0,0 +1,120 @@
+"""
+Federated retrieval: one set of query vectors searched against several indexes,
+then a selection policy over the fused candidates.
+
+The question and its expansions are embedded once; each index is searched
+with all of them in a single FAISS call, which returns one ranking of
+``RETRIEVAL_FETCH_K`` candidates per query vector. Candidates are
+``(document, vector)`` pairs, so the rankings of every index can be fused by
+rank (see ``fusion``) and the pool handed to ``select`` without embedding any
+chunk again.
+
+``select`` decides how many chunks the LLM sees. It drops candidates below
+``RETRIEVAL_MIN_SIMILARITY`` to the question (none left: answer without RAG)
+and cuts the rest at the first drop in similarity larger than
+``RETRIEVAL_SIMILARITY_CLIFF``. BM25 matches on an id or acronym from the
+question are exempt: such tokens barely move a dense embedding, so their
+similarity says little (see ``lexical.identifiers``). Of what remains it picks at most ``max_docs`` by maximal marginal
+relevance on the candidates' scores (fused or reranked), so near-duplicate
+chunks do not crowd out other evidence.
+"""
+import numpy as np
+from django.conf import settings
+
+from .fusion import document_key
+from .vectors import normalise
+
+
+def candidate_key(candidate):
+    return document_key(candidate[0])
+
+
+def search(store, vectors, k):
+    """One ranking of ``(document, vector)`` candidates, best first, per query vector in ``vectors``."""
+    if store is None or not len(vectors):
+        return []
+    queries = np.ascontiguousarray(vectors, dtype=np.float32)
+    if getattr(store, '_normalize_L2', False):
+        import faiss
+        faiss.normalize_L2(queries)
+    _, indices = store.index.search(queries, k)
+    rankings = []
+    for row in indices:
+        ranking = []
+        for i in row:
+            # FAISS pads with -1 when the index holds fewer than k vectors
+            if i == -1:
+                continue
+            doc = store.docstore.search(store.index_to_docstore_id[i])
+            if not isinstance(doc, str):
+                ranking.append((doc, store.index.reconstruct(int(i))))
+        rankings.append(ranking)
+    return rankings
+
+
+def lookup(store, doc_ids):
+    """``(document, vector)`` candidates for docstore ids, in order; unknown ids are skipped."""
+    positions = getattr(store, '_docstore_positions', None)
+    if positions is None or len(positions) != len(store.index_to_docstore_id):
+        positions = {doc_id: i for i, doc_id in store.index_to_docstore_id.items()}
+        store._docstore_positions = positions
+    candidates = []
+    for doc_id in doc_ids:
+        doc = store.docstore.search(doc_id)
+        if doc_id in positions and not isinstance(doc, str):
+            candidates.append((doc, store.index.reconstruct(positions[doc_id])))
+    return candidates
+
+
+def cutoff(relevance, floor, cliff):
+    """Indices of the candidates worth keeping, most relevant first."""
+    order = np.argsort(-relevance)
+    ranked = relevance[order]
+    keep = int(np.count_nonzero(ranked >= floor))
+    if keep <= 1:
+        return order[:keep]
+    gaps = np.flatnonzero(ranked[:keep - 1] - ranked[1:keep] > cliff)
+    if len(gaps):
+        keep = gaps[0] + 1
+    return order[:keep]
+
+
+def mmr(vectors, relevance, k, lambda_mult):
+    """Indices of up to ``k`` rows of ``vectors`` picked by maximal marginal relevance."""
+    similarity = vectors @ vectors.T
+    redundancy = np.zeros(len(relevance), dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    chosen = []
+    while len(chosen) < k and available.any():
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        chosen.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return chosen
+
+
+def select(question_vector, candidates, scores, max_docs, exempt=()):
+    """The documents to put in the LLM context, chosen from fused ``candidates``.
+
+    ``scores`` (one per candidate, higher is better, non-negative) rank the
+    candidates for MMR; those whose ``candidate_key`` is in ``exempt`` skip the
+    similarity floor and cliff.
+    """
+    if not candidates:
+        return []
+    vectors = normalise(np.vstack([vector for _, vector in candidates]))
+    question = normalise(question_vector)
+    similarity = vectors @ question
+    bypass = np.array([candidate_key(candidate) in exempt for candidate in candidates])
+    gated = np.flatnonzero(~bypass)
+    kept = np.concatenate([
+        gated[cutoff(similarity[gated], settings.RETRIEVAL_MIN_SIMILARITY, settings.RETRIEVAL_SIMILARITY_CLIFF)],
+        np.flatnonzero(bypass),
+    ])
+    if not len(kept):
+        return []
+    relevance = np.asarray(scores, dtype=np.float32)
+    relevance = relevance / max(float(relevance.max()), 1e-9)
+    picked = mmr(vectors[kept], relevance[kept], max_docs, settings.RETRIEVAL_MMR_LAMBDA)
+    return [candidates[kept[i]][0] for i in picked]
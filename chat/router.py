@@ -0,0 +1,116 @@
+"""
+Local agent router.
+
+Picks the expert agent for a standalone question by comparing its embedding
+with the centroid of labelled exemplar questions for each agent. Only when the
+best centroid does not beat the runner-up by ``ROUTER_MIN_MARGIN`` does the
+caller fall back to the LLM router (``prompt_chooser_chain``).
+"""
+import json
+import os
+
+import numpy as np
+from django.conf import settings
+
+from .vectors import normalise
+
+
+# Keys match the agent values posted by the UI
+EXEMPLARS = {
+    "methodology": [
+        "How do I determine the sample size for a randomized trial?",
+        "How do we design an impact evaluation for a literacy program?",
+        "What sampling strategy should I use for a household survey?",
+        "What is the difference between a quasi-experimental and an experimental design?",
+        "How do I stratify a sample across regions?",
+        "Which evaluation design fits a program that cannot randomize participants?",
+        "How do I structure data collection for a longitudinal study?",
+        "What are the strengths of a difference-in-differences approach?",
+    ],
+    "technical": [
+        "How can GIS mapping be used to track project impact?",
+        "What tools can we use for remote sensing in agriculture projects?",
+        "How can AI or machine learning support development programs?",
+        "How do I develop a Theory of Change for a health project?",
+        "What should a feasibility study for a solar mini-grid include?",
+        "Which technologies improve water and sanitation service delivery?",
+        "How do we assess the technical soundness of a project design?",
+        "What is a Theory of Development and how is it used?",
+    ],
+    "project_imp": [
+        "How can we adapt our project timeline to accommodate resource delays?",
+        "How do I build a Gantt chart for project activities?",
+        "How should we allocate budget and staff across project components?",
+        "What are good risk mitigation strategies during project execution?",
+        "How do we turn the work plan into actionable steps?",
+        "How can Agile project management help when implementation falls behind?",
+        "How do we integrate gender and social inclusion into project activities?",
+        "What is the best way to manage subcontractors during implementation?",
+    ],
+    "mel": [
+        "What are the best tools to track project performance indicators?",
+        "How do we track gender-specific outcomes in this program?",
+        "How do I conduct a data quality assessment (DQA)?",
+        "How do I build a logframe with indicators and targets?",
+        "What should a MEL plan contain?",
+        "How do we design a baseline and endline survey?",
+        "How can a dashboard support performance monitoring?",
+        "How do I write a performance management plan (PMP)?",
+    ],
+    "rules": [
+        "How do we ensure compliance with GDPR in our survey data collection?",
+        "What are the legal standards for fair labor in cocoa supply chains?",
+        "What donor requirements apply to procurement under a USAID award?",
+        "What anti-corruption measures should the project follow?",
+        "What environmental regulations apply to construction activities?",
+        "How do we protect the privacy of research participants?",
+        "What contractual obligations does the implementing partner have?",
+        "What are the branding and marking rules for USAID-funded materials?",
+    ],
+    "communication": [
+        "What is the best way to engage stakeholders in our community project?",
+        "What's the best way to raise awareness about our project's success?",
+        "How can we use media to raise awareness while adhering to local advertising laws?",
+        "How do I write a success story about the program?",
+        "How do we design an outreach campaign for rural communities?",
+        "How should we communicate during a crisis to maintain trust?",
+        "How can storytelling make our results more relatable?",
+        "How do we build a messaging framework for different audiences?",
+    ],
+}
+
+
+def load_exemplars():
+    """Built-in exemplars plus any labelled questions in ``ROUTER_EXEMPLARS_FILE``."""
+    exemplars = {label: list(questions) for label, questions in EXEMPLARS.items()}
+    path = settings.ROUTER_EXEMPLARS_FILE
+    if path and os.path.exists(path):
+        with open(path) as f:
+            for label, questions in json.load(f).items():
+                exemplars.setdefault(label, []).extend(questions)
+    return exemplars
+
+
+class CentroidRouter:
+    def __init__(self, embed_model, exemplars):
+        self.labels = list(exemplars)
+        centroids = []
+        for label in self.labels:
+            vectors = normalise(embed_model.embed_documents(exemplars[label]))
+            centroids.append(vectors.mean(axis=0))
+        self.centroids = normalise(np.stack(centroids))
+
+    def scores(self, vector):
+        return self.centroids @ normalise(vector)
+
+    def classify(self, vector):
+        """Return ``(label, margin)`` where margin is the lead over the runner-up centroid."""
+        scores = self.scores(vector)
+        order = np.argsort(-scores)
+        margin = float(scores[order[0]] - scores[order[1]]) if len(order) > 1 else 1.0
+        return self.labels[order[0]], margin
+
+    def route(self, vector):
+        """Return the agent label, or None when the decision is too close to call."""
+        label, margin = self.classify(vector)
+        return label if margin >= settings.ROUTER_MIN_MARGIN else None
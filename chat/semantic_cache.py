@@ -0,0 +1,158 @@
+"""
+Semantic answer cache.
+
+Answers are stored against the embedding of the standalone (cojoined) question.
+A new question whose embedding is within ``SEMANTIC_CACHE_THRESHOLD`` cosine
+similarity of a stored one, asked to the same agent, gets the stored answer
+without running the LLM pipeline. Entries expire after ``SEMANTIC_CACHE_TTL``
+seconds, the least recently used entry is evicted past
+``SEMANTIC_CACHE_MAX_ENTRIES``, and the whole cache is dropped when the corpus
+index on disk changes.
+
+The cache lives in each worker process. ``invalidate`` (called by
+``build_index`` and ``build_source_metadata`` after they replace what answers
+are built from) also rewrites a version file beside the corpus index, which
+every worker compares on its next lookup.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .vectors import normalise
+
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # key -> entry, least recently used first
+_matrix = None            # row i is the normalised vector of _keys[i]; rows past len(_keys) are spare capacity
+_keys = []                # may still name entries since dropped; compacted once they outnumber the live ones
+_next_key = 0
+_corpus_version = None
+_stats = {'hits': 0, 'misses': 0, 'inserts': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+
+def _version_file():
+    return f"{settings.FAISS_INDEX_DIR}.version"
+
+
+def corpus_version():
+    """Fingerprint of the corpus index on disk; changes whenever it is rebuilt or ``invalidate`` is called."""
+    version = []
+    for path in (os.path.join(settings.FAISS_INDEX_DIR, "index.faiss"), _version_file()):
+        try:
+            st = os.stat(path)
+        except OSError:
+            version.append(None)
+        else:
+            version.append((st.st_mtime_ns, st.st_size))
+    return tuple(version)
+
+
+def _clear():
+    global _matrix, _keys
+    _entries.clear()
+    _matrix = None
+    _keys = []
+
+
+def _append(key, vector):
+    global _matrix
+    if _matrix is None:
+        _matrix = np.empty((16, vector.shape[0]), dtype=np.float32)
+    elif len(_keys) == len(_matrix):
+        # Double the capacity so appends stay amortised O(1)
+        _matrix = np.concatenate([_matrix, np.empty_like(_matrix)])
+    _matrix[len(_keys)] = vector
+    _keys.append(key)
+
+
+def _compact():
+    global _matrix, _keys
+    live = [i for i, key in enumerate(_keys) if key in _entries]
+    _matrix = _matrix[live] if live else None
+    _keys = [_keys[i] for i in live]
+
+
+def _drop(key):
+    del _entries[key]
+    if len(_keys) > 2 * len(_entries):
+        _compact()
+
+
+def _check_corpus():
+    global _corpus_version
+    version = corpus_version()
+    if version != _corpus_version:
+        if _entries:
+            _stats['invalidations'] += 1
+        _clear()
+        _corpus_version = version
+
+
+def _expire(now):
+    expired = [key for key, entry in _entries.items() if now - entry['created_at'] > settings.SEMANTIC_CACHE_TTL]
+    for key in expired:
+        _drop(key)
+    _stats['expirations'] += len(expired)
+
+
+def lookup(vector, agent):
+    """Return the cached payload for the closest question above the threshold, or None."""
+    if not settings.SEMANTIC_CACHE_ENABLED:
+        return None
+    query = normalise(vector)
+    with _lock:
+        _check_corpus()
+        _expire(time.time())
+        if _entries:
+            scores = _matrix[:len(_keys)] @ query
+            # Only live entries answered by the same agent are candidates
+            for index in np.argsort(-scores):
+                if scores[index] < settings.SEMANTIC_CACHE_THRESHOLD:
+                    break
+                key = _keys[index]
+                if key in _entries and _entries[key]['agent'] == agent:
+                    _entries.move_to_end(key)
+                    _stats['hits'] += 1
+                    return _entries[key]['payload']
+        _stats['misses'] += 1
+        return None
+
+
+def store(vector, agent, payload):
+    global _next_key
+    if not settings.SEMANTIC_CACHE_ENABLED:
+        return
+    with _lock:
+        _check_corpus()
+        vector = normalise(vector)
+        _entries[_next_key] = {'agent': agent, 'payload': payload, 'created_at': time.time()}
+        _append(_next_key, vector)
+        _next_key += 1
+        _stats['inserts'] += 1
+        while len(_entries) > settings.SEMANTIC_CACHE_MAX_ENTRIES:
+            _drop(next(iter(_entries)))
+            _stats['evictions'] += 1
+
+
+def invalidate():
+    """Drop every cached answer, here and (through the version file) in every other worker."""
+    global _corpus_version
+    with _lock:
+        _clear()
+        _stats['invalidations'] += 1
+        try:
+            with open(_version_file(), 'w') as f:
+                f.write(str(time.time_ns()))
+        except OSError as e:
+            print(f"Could not update {_version_file()}: {e}")
+        _corpus_version = corpus_version()
+
+
+def stats():
+    with _lock:
+        lookups = _stats['hits'] + _stats['misses']
+        return {**_stats, 'entries': len(_entries), 'hit_rate': round(_stats['hits'] / lookups, 3) if lookups else None}
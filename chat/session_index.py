@@ -0,0 +1,185 @@
+"""
+Per-session FAISS indexes for uploaded documents.
+
+Every session's index is persisted under ``SESSION_INDEX_DIR/<session_id>`` as
+soon as documents are added, so uploads survive restarts. Loaded indexes are
+kept in an LRU bounded by ``SESSION_INDEX_MEMORY_BYTES``; an evicted index is
+loaded again from disk the next time its session asks for it, as is one that
+another process (the ingestion worker) has rewritten on disk.
+"""
+import os
+import re
+import shutil
+import threading
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import ann, resources, swap
+from .embeddings import embed_chunks
+from .fusion import assign_chunk_ids
+
+
+_SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{1,100}$')
+
+_lock = threading.Lock()
+_loaded = OrderedDict()  # session_id -> (store, approximate bytes, index file mtime), least recently used first
+# Sessions share a fixed set of locks, so the set never grows with the number of sessions
+_session_locks = [threading.RLock() for _ in range(64)]
+_stats = {'memory_hits': 0, 'disk_loads': 0, 'evictions': 0}
+
+
+def _path(session_id):
+    # Session ids come from the client; never let one escape the index directory
+    if not _SESSION_ID.match(session_id or ''):
+        raise ValueError(f"Invalid session id: {session_id!r}")
+    return os.path.join(settings.SESSION_INDEX_DIR, session_id)
+
+
+def _session_lock(session_id):
+    return _session_locks[zlib.crc32(session_id.encode()) % len(_session_locks)]
+
+
+def _size(store):
+    index = store.index
+    vectors = index.ntotal * ann.code_size(index)
+    texts = sum(len(doc.page_content) + 64 for doc in store.docstore._dict.values())
+    return vectors + texts
+
+
+def _mtime(path):
+    try:
+        return os.stat(os.path.join(path, "index.faiss")).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _keep(session_id, store, mtime):
+    with _lock:
+        _loaded[session_id] = (store, _size(store), mtime)
+        _loaded.move_to_end(session_id)
+        used = sum(entry[1] for entry in _loaded.values())
+        # Always keep the index just touched, even if it alone exceeds the budget
+        while used > settings.SESSION_INDEX_MEMORY_BYTES and len(_loaded) > 1:
+            evicted_id, (_, size, _) = _loaded.popitem(last=False)
+            used -= size
+            _stats['evictions'] += 1
+            print(f"Evicted upload index of session {evicted_id} from memory")
+
+
+def exists(session_id):
+    """Whether the session has an upload index on disk, without loading it."""
+    try:
+        path = _path(session_id)
+    except ValueError:
+        return False
+    return _mtime(path) is not None or _mtime(swap.previous(path)) is not None
+
+
+def _load(path):
+    # Readers never rename anything (see swap). Without ``path`` a swap is under way, or was
+    # interrupted, and .old holds the last complete index; by the time that is read the swap may
+    # have finished, so ``path`` is tried once more
+    from langchain_community.vectorstores import FAISS
+    error = None
+    for candidate in (path, swap.previous(path), path):
+        try:
+            return FAISS.load_local(candidate, embeddings=resources.get("embed_model"), allow_dangerous_deserialization=True)
+        except (OSError, RuntimeError) as e:
+            error = e
+    raise error
+
+
+def get(session_id):
+    """Return the session's upload index, or None if it has no uploads."""
+    try:
+        path = _path(session_id)
+    except ValueError:
+        return None
+    mtime = _mtime(path) or _mtime(swap.previous(path))
+    if mtime is None:
+        return None
+    with _session_lock(session_id):
+        with _lock:
+            entry = _loaded.get(session_id)
+            if entry is not None and entry[2] == mtime:
+                _loaded.move_to_end(session_id)
+                _stats['memory_hits'] += 1
+                return entry[0]
+        store = _load(path)
+        _stats['disk_loads'] += 1
+        _keep(session_id, store, mtime)
+    return store
+
+
+def add_documents(session_id, documents, upload=None):
+    """Embed ``documents`` (chunks of one file, in order) and add them to the session's index (see ``add_embedded``)."""
+    assign_chunk_ids(documents, upload=upload)
+    vectors = embed_chunks([doc.page_content for doc in documents])
+    return add_embedded(session_id, documents, vectors)
+
+
+def add_embedded(session_id, documents, vectors):
+    """Add already embedded ``documents`` to the session's index (creating it) and persist it.
+
+    The documents must carry chunk ids (``fusion.assign_chunk_ids``). Every chunk
+    of an earlier upload of a file with the same name is replaced; chunks of the
+    same upload (earlier batches of a table, or files sharing a name in one job)
+    are kept.
+    """
+    from langchain_community.vectorstores import FAISS
+    path = _path(session_id)
+    text_embeddings = [(doc.page_content, vector) for doc, vector in zip(documents, vectors)]
+    metadatas = [doc.metadata for doc in documents]
+    ids = [doc.id for doc in documents]
+    with _session_lock(session_id):
+        # Only writers finish an interrupted swap, before reading what they rewrite
+        swap.recover(path)
+        current = get(session_id)
+        if current is None:
+            store = FAISS.from_embeddings(text_embeddings, resources.get("embed_model"), metadatas=metadatas, ids=ids)
+            store.index = ann.build(store.index, "flat", {}, _storage())
+        else:
+            # Requests may be searching the loaded index right now: change a copy and swap it in
+            store = _copy(current)
+            sources = {doc.metadata.get('source') for doc in documents}
+            uploads = {doc.metadata.get('upload') for doc in documents}
+            new_ids = set(ids)
+            # A resumed job may index a batch it had already indexed, under the same ids
+            stale = [doc_id for doc_id, doc in store.docstore._dict.items()
+                     if doc_id in new_ids or (doc.metadata.get('source') in sources and doc.metadata.get('upload') not in uploads)]
+            if stale:
+                store.delete(stale)
+            store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        _save(store, path)
+        _keep(session_id, store, _mtime(path))
+    return store
+
+
+def _copy(store):
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    return FAISS(store.embedding_function, faiss.clone_index(store.index), InMemoryDocstore(dict(store.docstore._dict)),
+                 dict(store.index_to_docstore_id), normalize_L2=store._normalize_L2, distance_strategy=store.distance_strategy)
+
+
+def _storage():
+    # int8 ranges would be trained on the session's first upload alone and clip every later one;
+    # float16 needs no training
+    return "float16" if settings.VECTOR_STORAGE == "int8" else settings.VECTOR_STORAGE
+
+
+def _save(store, path):
+    # Write beside the old copy and swap, so a crash never leaves a half-written index
+    tmp_path = swap.staging(path)
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    store.save_local(tmp_path)
+    swap.replace(path)
+
+
+def stats():
+    with _lock:
+        return {**_stats, 'loaded_sessions': len(_loaded),
+                'loaded_bytes': sum(entry[1] for entry in _loaded.values())}
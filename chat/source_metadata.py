@@ -0,0 +1,71 @@
+"""
+Title/permalink lookup for corpus documents.
+
+The DECfinder export is reduced once to a compact ``{ID: [title, permalink]}``
+JSON map, and the same values are written into each chunk's ``metadata`` when
+an index is built or annotated, so serving a request never scans the CSV.
+"""
+import csv
+import json
+import os
+import re
+
+
+SOURCE_EXTENSIONS = re.compile(r'\.(?:pdf|docx|html|mp4|csv|enex|txt|eml|md|mmd|epub|odt|pptx|ppt|doc|xlsx|xls|jpg|png|srt)')
+
+
+def source_id(source):
+    """DEC document ID for a chunk's ``source`` path, e.g. ``.../PN-AAJ-839.txt`` -> ``PN-AAJ-839``."""
+    name = re.split(r'[\\/]', source)[-1]
+    return SOURCE_EXTENSIONS.split(name)[0]
+
+
+def read_csv(path):
+    """Build the ID -> (title, permalink) map from the DECfinder export."""
+    mapping = {}
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            # The first row wins, as the old pandas lookup took .tolist()[0]
+            mapping.setdefault(str(row["ID"]).strip(), (row["Title"], row["Permalink"]))
+    return mapping
+
+
+def write_map(mapping, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(mapping, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def read_map(path):
+    with open(path, encoding='utf-8') as f:
+        return {doc_id: tuple(value) for doc_id, value in json.load(f).items()}
+
+
+def load(map_path, csv_path):
+    """Prefer the compact JSON map; fall back to reading the CSV once."""
+    if os.path.exists(map_path):
+        return read_map(map_path)
+    return read_csv(csv_path)
+
+
+def annotate(documents, mapping):
+    """Store ``source_id``, ``title`` and ``permalink`` in each document's metadata.
+
+    Returns the number of documents that matched a DEC record.
+    """
+    matched = 0
+    for doc in documents:
+        doc_id = source_id(doc.metadata.get("source", ""))
+        doc.metadata["source_id"] = doc_id
+        if doc_id in mapping:
+            doc.metadata["title"], doc.metadata["permalink"] = mapping[doc_id]
+            matched += 1
+    return matched
+
+
+def lookup(metadata, mapping):
+    """``(title, permalink)`` for a chunk, from its own metadata or the ID map; None if unknown."""
+    if "title" in metadata:
+        return metadata["title"], metadata.get("permalink", " ")
+    return mapping.get(metadata.get("source_id") or source_id(metadata.get("source", "")))
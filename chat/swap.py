@@ -0,0 +1,81 @@
+"""
+Replacing an index directory without ever serving a half-written one.
+
+A new copy is written to ``staging(path)`` and ``replace`` swaps it in: the
+live directory is renamed to ``<path>.old``, the staged one to ``path``, and
+the old copy is deleted. The two renames are not atomic together, so a crash
+between them leaves no ``path``, the previous copy under ``.old`` and the new
+one, fully written, under ``.tmp``; ``recover`` finishes such a swap.
+
+``replace`` and ``recover`` hold an exclusive lock on ``<path>.lock`` (where
+``fcntl`` is available), so a process recovering never renames directories
+under another one that is in the middle of a swap. Readers that find no
+``path`` can load ``<path>.old`` instead of recovering.
+"""
+import os
+import shutil
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock
+    fcntl = None
+
+
+def staging(path):
+    return f"{path}.tmp"
+
+
+def previous(path):
+    return f"{path}.old"
+
+
+@contextmanager
+def lock(path):
+    if fcntl is None:
+        yield
+        return
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    with open(f"{path}.lock", 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _recover(path):
+    old_path = previous(path)
+    if os.path.exists(path) or not os.path.exists(old_path):
+        # A staging directory without an .old beside it may be half-written; the next write replaces it
+        return False
+    tmp_path = staging(path)
+    if os.path.exists(tmp_path):
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+    else:
+        os.rename(old_path, path)
+    return True
+
+
+def recover(path):
+    """Finish a swap of ``path`` interrupted between its two renames; True if there was one."""
+    with lock(path):
+        return _recover(path)
+
+
+def replace(path):
+    """Swap the fully written ``staging(path)`` in for ``path``.
+
+    Writers call ``recover`` before reading what they rewrite, so a staged copy
+    left by a crash is never silently dropped.
+    """
+    tmp_path, old_path = staging(path), previous(path)
+    with lock(path):
+        # Whatever is under .old now is older than the staged copy
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
@@ -0,0 +1,597 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from . import ann, conversation, corpus_index, fusion, ingest, lexical, pipeline, resources, retrieval, semantic_cache, session_index, swap, views
+from .models import IngestJob, Session
+from .vectors import normalise
+
+
+class CutoffTests(SimpleTestCase):
+    def test_nothing_above_the_floor(self):
+        relevance = np.array([0.1, 0.2, 0.3, 0.2, 0.1])
+        self.assertEqual(list(retrieval.cutoff(relevance, 0.45, 0.1)), [])
+
+    def test_single_candidate_above_the_floor(self):
+        relevance = np.array([0.2, 0.5, 0.3])
+        self.assertEqual(list(retrieval.cutoff(relevance, 0.45, 0.1)), [1])
+
+    def test_cuts_at_the_first_cliff(self):
+        relevance = np.array([0.6, 0.9, 0.85, 0.5])
+        self.assertEqual(list(retrieval.cutoff(relevance, 0.45, 0.1)), [1, 2])
+
+    def test_keeps_everything_without_a_cliff(self):
+        relevance = np.array([0.7, 0.8, 0.75])
+        self.assertEqual(list(retrieval.cutoff(relevance, 0.45, 0.1)), [1, 2, 0])
+
+
+class MMRTests(SimpleTestCase):
+    def test_relevance_only(self):
+        vectors = np.eye(3, dtype=np.float32)
+        relevance = np.array([0.2, 0.9, 0.5], dtype=np.float32)
+        self.assertEqual(retrieval.mmr(vectors, relevance, 3, 1.0), [1, 2, 0])
+
+    def test_skips_near_duplicates(self):
+        vectors = normalise(np.array([[1, 0], [1, 0.01], [0, 1]], dtype=np.float32))
+        relevance = np.array([0.9, 0.89, 0.7], dtype=np.float32)
+        self.assertEqual(retrieval.mmr(vectors, relevance, 2, 0.5), [0, 2])
+
+    def test_at_most_k(self):
+        vectors = np.eye(4, dtype=np.float32)
+        relevance = np.ones(4, dtype=np.float32)
+        self.assertEqual(len(retrieval.mmr(vectors, relevance, 2, 0.7)), 2)
+
+
+@override_settings(RETRIEVAL_MIN_SIMILARITY=0.45, RETRIEVAL_SIMILARITY_CLIFF=0.1, RETRIEVAL_MMR_LAMBDA=1.0)
+class SelectTests(SimpleTestCase):
+    question = [1.0, 0.0]
+
+    def candidates(self, *vectors):
+        return [(Document(page_content=f"chunk {i}", metadata={'chunk_id': str(i)}), np.array(vector, dtype=np.float32))
+                for i, vector in enumerate(vectors)]
+
+    def contents(self, documents):
+        return [doc.page_content for doc in documents]
+
+    def test_nothing_relevant(self):
+        candidates = self.candidates([0.0, 1.0], [0.1, 1.0], [-1.0, 0.2])
+        self.assertEqual(retrieval.select(self.question, candidates, [3, 2, 1], 8), [])
+
+    def test_no_candidates(self):
+        self.assertEqual(retrieval.select(self.question, [], [], 8), [])
+
+    def test_ranks_by_score_and_limits(self):
+        candidates = self.candidates([1.0, 0.1], [1.0, 0.0], [1.0, 0.2])
+        selected = retrieval.select(self.question, candidates, [0.02, 0.05, 0.03], 2)
+        self.assertEqual(self.contents(selected), ["chunk 1", "chunk 2"])
+
+    def test_drops_candidates_past_the_cliff(self):
+        candidates = self.candidates([1.0, 0.0], [0.5, 1.0])
+        selected = retrieval.select(self.question, candidates, [0.01, 0.05], 8)
+        self.assertEqual(self.contents(selected), ["chunk 0"])
+
+    def test_lexical_matches_skip_the_floor(self):
+        candidates = self.candidates([1.0, 0.0], [0.0, 1.0])
+        selected = retrieval.select(self.question, candidates, [0.02, 0.01], 8, exempt={"1"})
+        self.assertEqual(self.contents(selected), ["chunk 0", "chunk 1"])
+
+    def test_lexical_match_alone(self):
+        candidates = self.candidates([0.0, 1.0], [0.1, 1.0])
+        selected = retrieval.select(self.question, candidates, [0.02, 0.01], 8, exempt={"1"})
+        self.assertEqual(self.contents(selected), ["chunk 1"])
+
+
+class LexicalQueryTests(SimpleTestCase):
+    def test_stopwords_are_left_out(self):
+        self.assertEqual(lexical.match_query("What is the DQA for PN-AAJ-839?"), '"dqa" OR "pn-aaj-839"')
+
+    def test_only_stopwords(self):
+        self.assertEqual(lexical.match_query("What is it?"), "")
+
+    def test_identifiers(self):
+        self.assertEqual(lexical.identifiers("Is the DQA in PN-AAJ-839 due in 2024? Ask Ann"), {"dqa", "pn-aaj-839", "2024"})
+
+
+@override_settings(RETRIEVAL_MIN_SIMILARITY=0.45, RETRIEVAL_SIMILARITY_CLIFF=0.1, RETRIEVAL_MMR_LAMBDA=0.7,
+                   RETRIEVAL_POOL_SIZE=40, RETRIEVAL_MAX_DOCS=8, RETRIEVAL_MAX_DOCS_WITH_UPLOADS=13,
+                   RRF_K=60, RELEVANCE_FILTER="none")
+class HybridSelectionTests(SimpleTestCase):
+    query_vectors = [[1.0, 0.0]]
+
+    def candidate(self, chunk_id, text, vector):
+        return Document(page_content=text, metadata={'chunk_id': chunk_id}), np.array(vector, dtype=np.float32)
+
+    def test_off_topic_question_gets_no_context(self):
+        dense = [[self.candidate("1", "Indicator targets for the health activity", [0.1, 1.0])]]
+        # BM25 still matches the question's ordinary words
+        bm25 = [self.candidate("2", "The weather in the region delayed field visits", [0.0, 1.0]),
+                self.candidate("3", "Field visits are planned for the dry weather season", [0.2, 1.0])]
+        documents = views.fuse_documents("What will the weather be like this weekend?", self.query_vectors, dense, bm25, [])
+        self.assertEqual(documents, [])
+
+    def test_identifier_match_is_kept(self):
+        dense = [[self.candidate("1", "Indicator targets for the health activity", [0.1, 1.0])]]
+        bm25 = [self.candidate("2", "Evaluation report PN-AAJ-839, annex B", [0.0, 1.0])]
+        documents = views.fuse_documents("Summarise PN-AAJ-839", self.query_vectors, dense, bm25, [])
+        self.assertEqual([doc.metadata['chunk_id'] for doc in documents], ["2"])
+
+
+class IngestRunTests(TestCase):
+    def test_unexpected_error_fails_the_job(self):
+        user = User.objects.create_user("uploader")
+        job = IngestJob.objects.create(job_id="job", user=user, session_id="session", status='running', files=[
+            {'name': "a.pdf", 'stage': 'done', 'chunks': 3},
+            {'name': "b.pdf", 'stage': 'parsing', 'chunks': 0},
+        ])
+        with mock.patch.object(ingest, '_run', side_effect=RuntimeError("boom")):
+            ingest.run(job.job_id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual([entry['stage'] for entry in job.files], ['done', 'failed'])
+        self.assertEqual(job.files[1]['error'], "boom")
+
+
+class WorkerUploadTests(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        overrides = override_settings(INGEST_MODE="worker", INGEST_DIR=os.path.join(root, "uploads"),
+                                      INGEST_CACHE_DIR=os.path.join(root, "cache"), INGEST_PARSE_PROCESSES=1)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.user = User.objects.create_user("uploader")
+
+    def test_small_text_upload_reaches_the_worker_without_touching_the_disk(self):
+        upload = SimpleUploadedFile("notes.txt", b"Indicator results for the year.")
+        job = ingest.submit(self.user, "session", [upload])
+        self.assertTrue(job.files[0]['in_memory'])
+        self.assertFalse(os.path.exists(settings.INGEST_DIR))
+        self.assertEqual(bytes(job.uploads.get(position=0).data), b"Indicator results for the year.")
+
+        with mock.patch.dict(resources._resources, {"embed_model": DeterministicFakeEmbedding(size=8)}), \
+                mock.patch.object(session_index, 'add_embedded') as add_embedded:
+            self.assertTrue(ingest.claim(job.job_id))
+            ingest.run(job.job_id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        documents = add_embedded.call_args[0][1]
+        self.assertEqual([doc.page_content for doc in documents], ["Indicator results for the year."])
+        self.assertFalse(job.uploads.exists())
+
+
+class UploadOwnershipTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # chat_session predates the app's migrations, so the test database has no table for it
+        with connection.schema_editor() as editor:
+            editor.create_model(Session)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as editor:
+            editor.delete_model(Session)
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.other = User.objects.create_user("other")
+        Session.objects.create(user=self.owner, session_id="owned")
+
+    def upload(self, user, session_id):
+        self.client.force_login(user)
+        with mock.patch.object(ingest, 'submit') as submit:
+            submit.return_value = IngestJob(job_id="job", user=user, session_id=session_id, files=[])
+            response = self.client.post("/upload_files", {'sessionId': session_id,
+                                                          'files': SimpleUploadedFile("notes.txt", b"text")})
+        return response, submit
+
+    def test_upload_into_another_users_session_is_refused(self):
+        response, submit = self.upload(self.other, "owned")
+        self.assertEqual(response.status_code, 404)
+        submit.assert_not_called()
+
+    def test_upload_into_own_session_is_queued(self):
+        response, submit = self.upload(self.owner, "owned")
+        self.assertEqual(response.status_code, 202)
+        submit.assert_called_once()
+
+
+class SessionIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        overrides = override_settings(SESSION_INDEX_DIR=self.directory, VECTOR_STORAGE="float32",
+                                      SESSION_INDEX_MEMORY_BYTES=1 << 30)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        patcher = mock.patch.dict(resources._resources, {"embed_model": DeterministicFakeEmbedding(size=8)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        session_index._loaded.clear()
+        self.addCleanup(session_index._loaded.clear)
+        self.rng = np.random.default_rng(0)
+
+    def add(self, name, chunks, upload, start=0, part=0):
+        documents = [Document(page_content=f"{name} {upload} {i}", metadata={'source': name}) for i in range(start, start + chunks)]
+        fusion.assign_chunk_ids(documents, start=start, upload=upload, part=part)
+        return session_index.add_embedded("session", documents, self.rng.random((chunks, 8)).tolist())
+
+    def sources(self):
+        session_index._loaded.clear()
+        store = session_index.get("session")
+        return sorted((doc.metadata['source'], doc.metadata['upload']) for doc in store.docstore._dict.values())
+
+    def test_same_name_in_one_job(self):
+        self.add("a.csv", 2, "job", part=0)
+        self.add("a.csv", 1, "job", part=1)
+        self.assertEqual(self.sources(), [("a.csv", "job")] * 3)
+
+    def test_reupload_replaces_every_chunk(self):
+        self.add("a.pdf", 3, "job", part=0)
+        self.add("b.pdf", 1, "job", part=1)
+        self.add("a.pdf", 1, "later")
+        self.assertEqual(self.sources(), [("a.pdf", "later"), ("b.pdf", "job")])
+
+    def test_table_batches_accumulate(self):
+        self.add("t.csv", 2, "job")
+        self.add("t.csv", 2, "job", start=2)
+        # A resumed job indexes its last batch again
+        self.add("t.csv", 2, "job", start=2)
+        self.assertEqual(len(self.sources()), 4)
+
+    def crash_between_renames(self):
+        path = session_index._path("session")
+        session_index.get("session").save_local(swap.staging(path))
+        os.rename(path, swap.previous(path))
+        return path
+
+    def test_reader_uses_the_old_copy(self):
+        self.add("a.pdf", 1, "job", part=0)
+        self.add("b.pdf", 1, "job", part=1)
+        path = self.crash_between_renames()
+        self.assertTrue(session_index.exists("session"))
+        self.assertEqual(len(self.sources()), 2)
+        # Reading never moves anything
+        self.assertFalse(os.path.exists(path))
+
+    def test_writer_recovers_the_staged_copy(self):
+        self.add("a.pdf", 1, "first")
+        path = self.crash_between_renames()
+        self.add("b.pdf", 1, "second")
+        self.assertEqual(self.sources(), [("a.pdf", "first"), ("b.pdf", "second")])
+        self.assertEqual(sorted(os.listdir(self.directory)), ["session", "session.lock"])
+        self.assertTrue(os.path.exists(path))
+
+    def test_leftover_old_copy(self):
+        self.add("a.pdf", 1, "first")
+        path = session_index._path("session")
+        shutil.copytree(path, swap.previous(path))
+        self.add("b.pdf", 1, "second")
+        self.assertEqual(len(self.sources()), 2)
+
+    def test_loaded_index_is_not_changed_in_place(self):
+        before = self.add("a.pdf", 2, "first")
+        after = self.add("b.pdf", 1, "second")
+        self.assertIsNot(before, after)
+        self.assertEqual((before.index.ntotal, len(before.docstore._dict)), (2, 2))
+        self.assertIs(session_index.get("session"), after)
+
+
+@override_settings(INGEST_TABLE_BATCH_ROWS=1, INGEST_TABLE_PERSIST_BATCHES=2)
+class TableIngestTests(TestCase):
+    csv = b"indicator,value\n" + b"".join(b"row %d,%d\n" % (i, i) for i in range(5))
+
+    def ingest(self, **entry):
+        user = User.objects.create_user("uploader")
+        job = IngestJob.objects.create(job_id="job", user=user, session_id="session", status='running',
+                                       files=[{'name': "t.csv", 'stage': 'queued', 'chunks': 0, **entry}])
+        calls = []
+        with mock.patch.object(ingest, 'embed_chunks', side_effect=lambda texts: [[0.0] * 8 for _ in texts]), \
+                mock.patch.object(ingest.session_index, 'add_embedded', side_effect=lambda session_id, documents, vectors: calls.append(list(documents))):
+            ingest._ingest_table(job, job.files[0], self.csv, 0, lambda entry, name, **fields: entry.update(stage=name, **fields))
+        return job.files[0], calls
+
+    def test_batches_are_written_together(self):
+        entry, calls = self.ingest()
+        self.assertEqual([len(documents) for documents in calls], [2, 2, 1])
+        self.assertEqual((entry['stage'], entry['chunks'], entry['batches']), ('done', 5, 5))
+        ids = [doc.id for documents in calls for doc in documents]
+        self.assertEqual(ids, [fusion.chunk_id("t.csv", offset, "job/0") for offset in range(5)])
+
+    def test_resume_skips_written_batches(self):
+        entry, calls = self.ingest(chunks=2, batches=2)
+        self.assertEqual([[doc.metadata['row'] for doc in documents] for documents in calls], [[2, 3], [4]])
+        self.assertEqual(calls[0][0].id, fusion.chunk_id("t.csv", 2, "job/0"))
+        self.assertEqual(entry['chunks'], 5)
+
+
+class CorpusBuildTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        self.source_dir = os.path.join(root, "documents")
+        self.index_dir = os.path.join(root, "index")
+        os.makedirs(self.source_dir)
+        for name in ("a.txt", "b.txt", "c.txt"):
+            self.write(name, f"Report {name}: indicator results for the year.")
+        self.embedded = []
+        embedded = self.embedded
+
+        class RecordingEmbedding(DeterministicFakeEmbedding):
+            def embed_documents(self, texts):
+                embedded.extend(texts)
+                return super().embed_documents(texts)
+
+        patcher = mock.patch.dict(resources._resources, {"embed_model": RecordingEmbedding(size=8)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, name, text):
+        with open(os.path.join(self.source_dir, name), 'w') as f:
+            f.write(text)
+
+    def build(self, **options):
+        return corpus_index.build(self.source_dir, self.index_dir, processes=1, timeout=60, log=lambda message: None, **options)
+
+    def sources(self):
+        store, _ = corpus_index.load(self.index_dir)
+        return sorted(os.path.basename(doc.metadata['source']) for doc in store.docstore._dict.values())
+
+    def test_only_changed_files_are_embedded(self):
+        self.assertEqual(self.build(), (3, 0, 0))
+        self.embedded.clear()
+        self.assertEqual(self.build(), (0, 0, 0))
+        self.assertEqual(self.embedded, [])
+        self.write("b.txt", "Report b.txt, revised: new indicator results.")
+        self.assertEqual(self.build(), (0, 1, 0))
+        self.assertEqual(self.embedded, ["Report b.txt, revised: new indicator results."])
+        self.assertEqual(self.sources(), ["a.txt", "b.txt", "c.txt"])
+
+    def test_chunk_ids_are_stable_across_rebuilds(self):
+        self.build()
+        first = set(corpus_index.read_manifest(self.index_dir)[os.path.join(self.source_dir, "a.txt")]['ids'])
+        self.write("a.txt", "Report a.txt, revised.")
+        self.build()
+        self.assertEqual(set(corpus_index.read_manifest(self.index_dir)[os.path.join(self.source_dir, "a.txt")]['ids']), first)
+
+    def test_interrupted_build_resumes_from_its_checkpoint(self):
+        save = corpus_index.save
+
+        def crash_on_final_save(store, manifest, index_dir, *args, **kwargs):
+            if index_dir == self.index_dir:
+                raise KeyboardInterrupt
+            return save(store, manifest, index_dir, *args, **kwargs)
+
+        with mock.patch.object(corpus_index, 'save', side_effect=crash_on_final_save):
+            with self.assertRaises(KeyboardInterrupt):
+                self.build(checkpoint_files=1)
+        self.assertTrue(os.path.exists(f"{self.index_dir}.build"))
+        self.embedded.clear()
+        self.build(checkpoint_files=1)
+        self.assertEqual(self.embedded, [])
+        self.assertEqual(self.sources(), ["a.txt", "b.txt", "c.txt"])
+        self.assertFalse(os.path.exists(f"{self.index_dir}.build"))
+
+    def test_load_recovers_an_interrupted_swap(self):
+        self.build()
+        os.rename(self.index_dir, swap.previous(self.index_dir))
+        self.assertEqual(self.sources(), ["a.txt", "b.txt", "c.txt"])
+        self.assertTrue(os.path.exists(self.index_dir))
+
+
+class IndexParamsTests(SimpleTestCase):
+    def test_pq_codes_must_divide_the_dimension(self):
+        with self.assertRaises(ValueError):
+            ann.check("ivf_pq", {'pq_m': 48}, "float32", dim=100)
+        ann.check("ivf_pq", {'pq_m': 48}, "float32", dim=384)
+
+    def test_non_positive_params_are_rejected(self):
+        with self.assertRaises(ValueError):
+            ann.check("ivf_flat", {'nlist': 0})
+        with self.assertRaises(ValueError):
+            ann.check("annoy", {})
+
+    def test_small_corpora_get_fewer_lists(self):
+        self.assertEqual(ann._nlist({'nlist': 1024}, 390), 10)
+        self.assertEqual(ann._nlist({}, 5), 1)
+
+    @override_settings(CORPUS_INDEX_PARAMS={'pq_m': 7})
+    def test_build_index_fails_before_embedding(self):
+        with mock.patch.dict(resources._resources, {"embed_model": DeterministicFakeEmbedding(size=8)}), \
+                mock.patch.object(corpus_index, 'build') as build:
+            with self.assertRaises(CommandError):
+                call_command('build_index', tempfile.gettempdir(), index_type="ivf_pq")
+        build.assert_not_called()
+
+
+class ResourceRetryTests(SimpleTestCase):
+    def setUp(self):
+        self.loader = mock.Mock(side_effect=RuntimeError("model missing"))
+        resources.register("flaky", self.loader, required=False)
+
+        def unregister():
+            for registry in (resources._loaders, resources._locks, resources._errors, resources._failures):
+                registry.pop("flaky", None)
+        self.addCleanup(unregister)
+
+    @override_settings(RESOURCE_RETRY_SECONDS=60, RESOURCE_RETRY_MAX_SECONDS=300)
+    def test_failure_is_cached_until_the_retry_delay(self):
+        for _ in range(3):
+            with self.assertRaises(RuntimeError):
+                resources.get("flaky")
+        self.assertEqual(self.loader.call_count, 1)
+        self.assertIn("model missing", resources.status()["flaky"]['error'])
+
+    @override_settings(RESOURCE_RETRY_SECONDS=0)
+    def test_loader_is_retried_after_the_delay(self):
+        with self.assertRaises(RuntimeError):
+            resources.get("flaky")
+        self.loader.side_effect = None
+        self.loader.return_value = "model"
+        self.assertEqual(resources.get("flaky"), "model")
+        self.assertNotIn("flaky", resources._failures)
+        resources._resources.pop("flaky")
+
+    def test_delay_doubles_up_to_the_maximum(self):
+        with override_settings(RESOURCE_RETRY_SECONDS=5, RESOURCE_RETRY_MAX_SECONDS=30):
+            self.assertEqual([resources._retry_delay(n) for n in (1, 2, 3, 4)], [5, 10, 20, 30])
+
+
+class NormaliseTests(SimpleTestCase):
+    def test_rows_and_single_vectors(self):
+        rows = normalise([[3.0, 4.0], [0.0, 0.0]])
+        np.testing.assert_allclose(rows, [[0.6, 0.8], [0.0, 0.0]])
+        np.testing.assert_allclose(normalise([0.0, 2.0]), [0.0, 1.0])
+        self.assertEqual(rows.dtype, np.float32)
+
+
+class SemanticCacheTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        patcher = override_settings(FAISS_INDEX_DIR=os.path.join(root, "faiss_hf"), SEMANTIC_CACHE_ENABLED=True,
+                                    SEMANTIC_CACHE_THRESHOLD=0.95, SEMANTIC_CACHE_TTL=3600, SEMANTIC_CACHE_MAX_ENTRIES=3)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        semantic_cache._clear()
+        self.addCleanup(semantic_cache._clear)
+
+    @staticmethod
+    def vector(i):
+        v = np.zeros(8, dtype=np.float32)
+        v[i] = 1
+        return v
+
+    def test_hit_needs_a_similar_question_and_the_same_agent(self):
+        semantic_cache.store(self.vector(0), "dec", "answer")
+        self.assertEqual(semantic_cache.lookup(self.vector(0) * 2, "dec"), "answer")
+        self.assertIsNone(semantic_cache.lookup(self.vector(0), "usaid"))
+        self.assertIsNone(semantic_cache.lookup(self.vector(1), "dec"))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        for i in range(3):
+            semantic_cache.store(self.vector(i), "dec", i)
+        semantic_cache.lookup(self.vector(0), "dec")
+        semantic_cache.store(self.vector(3), "dec", 3)
+        self.assertEqual(semantic_cache.lookup(self.vector(0), "dec"), 0)
+        self.assertIsNone(semantic_cache.lookup(self.vector(1), "dec"))
+        for i in range(4, 8):
+            semantic_cache.store(self.vector(i), "dec", i)
+        # Dropped rows are compacted away and the rest still map to their entries
+        self.assertLessEqual(len(semantic_cache._keys), 2 * len(semantic_cache._entries))
+        self.assertEqual([semantic_cache.lookup(self.vector(i), "dec") for i in (5, 6, 7)], [5, 6, 7])
+
+    def test_expired_entries_are_not_served(self):
+        semantic_cache.store(self.vector(0), "dec", "answer")
+        with mock.patch.object(semantic_cache.time, 'time', return_value=semantic_cache.time.time() + 7200):
+            self.assertIsNone(semantic_cache.lookup(self.vector(0), "dec"))
+
+    def test_invalidate_reaches_other_workers(self):
+        semantic_cache.store(self.vector(0), "dec", "answer")
+        worker_version = semantic_cache.corpus_version()
+        semantic_cache.invalidate()
+        self.assertNotEqual(semantic_cache.corpus_version(), worker_version)
+        self.assertIsNone(semantic_cache.lookup(self.vector(0), "dec"))
+
+
+class PipelineExecutorTests(SimpleTestCase):
+    def test_concurrent_first_calls_share_one_pool(self):
+        def slow_pool(**kwargs):
+            time.sleep(0.05)
+            return object()
+
+        with mock.patch.object(pipeline, '_executor', None), \
+                mock.patch.object(pipeline, 'ThreadPoolExecutor', side_effect=slow_pool) as pool:
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(pipeline.get_executor())) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(pool.call_count, 1)
+        self.assertEqual(len(set(map(id, results))), 1)
+
+
+class SSEFramingTests(SimpleTestCase):
+    def test_event_is_one_data_line_and_a_blank_line(self):
+        frame = views.sse_event("token", {'text': "line one\nline two"})
+        self.assertTrue(frame.endswith("\n\n"))
+        lines = frame[:-2].split("\n")
+        self.assertEqual(lines[0], "event: token")
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith("data: "))
+        self.assertEqual(json.loads(lines[1][len("data: "):]), {'text': "line one\nline two"})
+
+    def test_frames_split_on_blank_lines(self):
+        stream = "".join([views.sse_event("token", "a"), views.sse_event("sources", []), views.sse_event("done", {})])
+        events = [frame.split("\n")[0] for frame in stream.split("\n\n") if frame]
+        self.assertEqual(events, ["event: token", "event: sources", "event: done"])
+
+
+class FusionTests(SimpleTestCase):
+    def doc(self, name):
+        return Document(page_content=name, metadata={'source': name})
+
+    def test_documents_found_by_both_rankings_rise(self):
+        a, b, c = self.doc("a"), self.doc("b"), self.doc("c")
+        fused = fusion.reciprocal_rank_fusion([[a, b], [c, b]], k=60, with_scores=True)
+        self.assertEqual(fused[0][0].page_content, "b")
+        self.assertAlmostEqual(fused[0][1], 1 / 62 + 1 / 62)
+        self.assertEqual({doc.page_content for doc, _ in fused[1:]}, {"a", "c"})
+
+    def test_duplicates_merge_by_chunk_id(self):
+        first, second = self.doc("same text"), self.doc("same text")
+        fusion.assign_chunk_ids([first], upload="job", part=0)
+        fusion.assign_chunk_ids([second], upload="job", part=0)
+        self.assertEqual(len(fusion.reciprocal_rank_fusion([[first], [second]])), 1)
+
+    def test_chunk_ids_are_stable_and_scoped_to_the_upload(self):
+        self.assertEqual(fusion.chunk_id("a.pdf", 3), fusion.chunk_id("a.pdf", 3))
+        self.assertNotEqual(fusion.chunk_id("a.pdf", 3), fusion.chunk_id("a.pdf", 4))
+        self.assertNotEqual(fusion.chunk_id("a.pdf", 3, "job/0"), fusion.chunk_id("a.pdf", 3, "job/1"))
+        docs = [self.doc("a.pdf"), self.doc("a.pdf")]
+        fusion.assign_chunk_ids(docs, start=5, upload="job", part=1)
+        self.assertEqual([doc.id for doc in docs], [fusion.chunk_id("a.pdf", 5, "job/1"), fusion.chunk_id("a.pdf", 6, "job/1")])
+        self.assertEqual(docs[0].metadata['chunk_id'], docs[0].id)
+
+
+@override_settings(CONVERSATION_CACHE=None, CONVERSATION_TTL=60, CONVERSATION_LOCAL_MAX_SESSIONS=2, CONVERSATION_MAX_TURNS=10)
+class ConversationStoreTests(SimpleTestCase):
+    def setUp(self):
+        conversation._local.clear()
+        self.addCleanup(conversation._local.clear)
+
+    def test_history_expires_after_the_ttl(self):
+        conversation.append("s", "first question")
+        self.assertEqual(conversation.get_history("s"), ["first question"])
+        later = time.monotonic() + 61
+        with mock.patch.object(conversation.time, 'monotonic', return_value=later):
+            self.assertEqual(conversation.get_history("s"), [])
+
+    def test_least_recently_used_session_is_evicted(self):
+        conversation.append("a", "qa")
+        conversation.append("b", "qb")
+        conversation.get_history("a")
+        conversation.append("c", "qc")
+        self.assertEqual(list(conversation._local), ["a", "c"])
+        self.assertEqual(conversation.get_history("b"), [])
+
+    def test_history_is_trimmed(self):
+        for i in range(11):
+            conversation.append("s", f"q{i}")
+        self.assertEqual(conversation.get_history("s"), [f"q{i}" for i in range(4, 11)])
@@ -1,15 +1,19 @@
 from django.urls import path
-from .views import index, upload_files, chat_message, retrieve_chat_history, login_view, register, create_new_session, logout_user, soft_delete_chat, soft_select_chat
+from .views import index, upload_files, upload_status, chat_message, chat_message_stream, retrieve_chat_history, login_view, register, create_new_session, logout_user, soft_delete_chat, soft_select_chat, healthz, readyz
 
 urlpatterns = [
     path('', index, name='index'),
     path('upload_files', upload_files, name='upload_files'),
+    path('upload_status', upload_status, name='upload_status'),
     path('chat_message', chat_message, name='chat_message'),
+    path('chat_message_stream', chat_message_stream, name='chat_message_stream'),
     path('retrieve_chat_history', retrieve_chat_history, name='retrieve_chat_history'),
     path('login/', login_view, name='login'),
     path('register/', register, name='register'),  # Add this line
     path('create_new_session', create_new_session, name='create_new_session'),  # Add this line
     path('logout_user', logout_user, name='logout_user'),
     path('soft_delete_chat', soft_delete_chat, name='soft_delete_chat'),
-    path('soft_select_chat', soft_select_chat, name='soft_select_chat')
+    path('soft_select_chat', soft_select_chat, name='soft_select_chat'),
+    path('healthz', healthz, name='healthz'),
+    path('readyz', readyz, name='readyz')
 ]
\ No newline at end of file
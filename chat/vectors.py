@@ -0,0 +1,12 @@
+"""
+Small numpy helpers for embedding vectors, shared by retrieval, the router,
+query expansion and the semantic cache.
+"""
+import numpy as np
+
+
+def normalise(vectors):
+    """``vectors`` (one vector or a matrix of rows) scaled to unit length; zero vectors stay zero."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
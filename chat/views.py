@@ -1,6 +1,6 @@
 # Django imports
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.db import connection
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
@@ -9,52 +9,21 @@ from django.contrib.auth.models import User
 
 # Local imports
 from .forms import UserRegistrationForm
-from .models import Session
+from .models import IngestJob, Session
+from . import conversation, expansion, fusion, ingest, ingest_cache, lexical, pipeline, rerank, resources, retrieval, semantic_cache, session_index, source_metadata
 
 # Python built-in modules
-import os
 import uuid
 import json
-import tempfile
-import warnings
 import re
-import string
-import random
-from collections import OrderedDict
-from io import BytesIO
-
-# Third-party libraries
-import pandas as pd
 
 # LangChain and associated tools
 from langchain_core.prompts import PromptTemplate
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_classic.retrievers.multi_query import MultiQueryRetriever
+from langchain_classic.retrievers.multi_query import DEFAULT_QUERY_PROMPT
 
 from langchain_core.output_parsers import StrOutputParser
 # from langchain_core.output_parsers import JsonOutputParser  # Optional
 
-# LangChain community loaders and text splitters
-from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import (
-    CSVLoader,
-    EverNoteLoader,
-    PyMuPDFLoader,
-    TextLoader,
-    UnstructuredEmailLoader,
-    UnstructuredHTMLLoader,
-    UnstructuredMarkdownLoader,
-    UnstructuredEPubLoader,
-    UnstructuredODTLoader,
-    UnstructuredPowerPointLoader,
-    UnstructuredWordDocumentLoader,
-    UnstructuredExcelLoader,
-    UnstructuredImageLoader,
-    SRTLoader
-)
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-
-
 # Optional integrations
 # from crewai import Agent, Task, Crew, Process
 # import gradio as gr
@@ -64,71 +33,13 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 # from langchain_core.prompts import ChatPromptTemplate
 # from langchain_core.runnables import RunnablePassthrough
 
-# Chat model
-from langchain_groq import ChatGroq
-
 # Django settings
 from django.conf import settings
-from dotenv import load_dotenv
-
-load_dotenv()
-
-# API key for groq and setting up models
-os.environ["GROQ_API_KEY"]=os.getenv("GROQ_API_KEY")
-g_llm=ChatGroq(model="llama-3.3-70b-versatile", temperature=0)
-llm=ChatGroq(model="llama-3.1-8b-instant", temperature=0)
-m_llm=ChatGroq(model="llama-3.1-8b-instant",temperature=0)
-
-# MODEL_ID = "Alibaba-NLP/gte-large-en-v1.5"
-MODEL_ID ="Alibaba-NLP/gte-multilingual-base"
-embed_model = HuggingFaceEmbeddings(model_name=MODEL_ID, model_kwargs={'trust_remote_code':True})
-
-
-# Setting up Index
 
-# Uncomment to run on decipher server
-docsearch=FAISS.load_local("./faiss_hf", embeddings=embed_model, allow_dangerous_deserialization=True)
-
-
-# Uncomment for local computer
-# docsearch= FAISS.load_local("./faiss_hf", embeddings=embed_model, allow_dangerous_deserialization=True)
-
-# Load metadata
-
-# Loading metadata file on local_computer
-# data=pd.read_csv("./chat/DECfinder export with permalinks.csv")
-# print(data["ID"].iloc[0])
-
-# Loading metadata file on server
-data=pd.read_csv("./chat/DECfinder export with permalinks.csv")
-print(data["ID"].iloc[0])
-
-
-# Set Upload directory for upload feature
-upload_dir = os.path.join(settings.BASE_DIR, 'uploaded_files')  # or settings.MEDIA_ROOT
-os.makedirs(upload_dir, exist_ok=True)
-
-
-# Initialise loaders for Uploaded materials
-Loader_map={".csv":(CSVLoader, {}),
-            ".enex":  (EverNoteLoader,{}),
-            ".pdf":(PyMuPDFLoader,{}),
-            ".txt":(TextLoader,{"encoding":"utf8"}),
-            ".eml":(UnstructuredEmailLoader,{}),
-            ".html":(UnstructuredHTMLLoader,{}),
-            ".md":(UnstructuredMarkdownLoader,{}),
-            ".mmd":(UnstructuredMarkdownLoader,{}),
-            ".epub":(UnstructuredEPubLoader,{}),
-            ".odt":(UnstructuredODTLoader,{}),
-            ".pptx":(UnstructuredPowerPointLoader,{}),
-            ".ppt":(UnstructuredPowerPointLoader,{}),
-            ".doc":(UnstructuredWordDocumentLoader,{}),
-            ".docx":(UnstructuredWordDocumentLoader,{}),
-#             ".xlsx":(UnstructuredExcelLoader,{}),
-#             ".xls":(UnstructuredExcelLoader,{}),
-            ".jpg":(UnstructuredImageLoader,{}),
-            ".png":(UnstructuredImageLoader,{}),
-           ".srt":(SRTLoader,{})}
+# Models, the FAISS corpus and the source metadata are loaded on first use (or
+# during warmup) by the resource registry, not at import time.
+g_llm=resources.lazy_runnable("g_llm")
+llm=resources.lazy_runnable("llm")
 
 
 # Helper functions
@@ -384,6 +295,10 @@ r_grader_prompt=PromptTemplate(template= """<|begin_of_text|><|start_header_id|>
 retrieval_grader=r_grader_prompt | llm | StrOutputParser()
 
 
+# Query expansion: the MultiQueryRetriever prompt, run once per question for every index
+multi_query_chain=DEFAULT_QUERY_PROMPT | g_llm | StrOutputParser()
+
+
 # rewrite question: Done when the initial question doesnt get enough important information from the vector database and to confirm if there will be a better output if the context of the question is clearer.
 rewrite_prompt=PromptTemplate(template=
                               """<|begin_of_text|><|start_header_id|>system<|end_header_id|>
@@ -1315,104 +1230,35 @@ def index(request):
     return render(request, 'index.html', context)
 
 @login_required
-# total_files=[]
 def upload_files(request):
     if request.method == "POST" and request.FILES:
         files = request.FILES.getlist('files')
-        global newsearch
-        # global newsearch_id
+        session_id = request.POST.get('sessionId', '')
+        if not session_id:
+            return JsonResponse({'error': 'Start a chat session before uploading files.'}, status=400)
+        # Uploads are indexed into the session, so it must be one of the user's own
+        if not Session.objects.filter(session_id=session_id, user=request.user).exists():
+            return JsonResponse({'error': 'Unknown chat session'}, status=404)
         # Limit to a maximum of 5 files
         if len(files) > 5:
             return JsonResponse({'error': 'You can only upload up to 5 files.'}, status=400)
-        else:
-            file_array=[]
-            for file in files:
-                file_array.append(file)
-                print("Uploaded file:", file.name)
-            for i,file in enumerate(file_array):
-    #             # if file.split('/')[-1] not in file_:
-    #                 # files.append(file)
-                  ext = "." + file.name.rsplit(".", 1)[-1].lower()
-                  print(ext)
-                  if ext in Loader_map:
-                    file_path = os.path.join(upload_dir, file.name)
-
-                    # Save file with original name
-                    with open(file_path, 'wb+') as destination:
-                        for chunk in file.chunks():
-                            destination.write(chunk)
-                    try:
-                        loader_class, loader_args = Loader_map[ext]
-                        loader = loader_class(file_path, **loader_args)
-                        document = loader.load()          
-                              
-                    except FileNotFoundError:
-                        print(f"error:{file.name})")
-                        print(f"No such file or directory: {file.name}")
-                    except Exception as e:
-                        print(e)
-                    
-                  else:
-                    print(f"Unsupported file type: {file.name}")
-                    continue
-                  try:
-                     if document:
-                        text_splitter=RecursiveCharacterTextSplitter(
-                        separators=["\n\n", "\n"], chunk_size=1000, chunk_overlap=100)
-                          # Use dynamic seperator to split and finall embed documents
-                        texts=text_splitter.split_documents(document)
-                        print(len(texts))
-                  except Exception as e:
-                     print(e)
-                     continue   
-                  # print(texts[0])
-                  embeddings=embed_model
-                  # embeddings=OpenAIEmbeddings()
-                  
-                  try:
-                      if newsearch:
-                        try:
-                            if newsearch[session_id]:
-                            #   newsearch_id = session_id
-                                print(f"Session Id: {session_id}")
-                                #   print(f"new_search_id: {newsearch_id}")
-                                try:
-                                    print(f"len text: {len(texts)}")
-                                    newsearch[session_id].add_documents(texts)
-            #                           # file_.append(file.split('/')[-1])
-            #   #                         print("Upload successful")
-                                except Exception as e:
-                                    print(f"error on {i+1}th file")
-                        except:
-                           newsearch[session_id] = FAISS.from_documents(documents=texts, embedding=embeddings)                                    
-                  except Exception as e:
-                      newsearch = OrderedDict()
-                      print(e)
-                      try:
-                        #   newsearch_id = session_id
-                        newsearch[session_id] = FAISS.from_documents(documents=texts, embedding=embeddings)
-                        print(f"Session Id: {session_id}")
-                        #   print(f"new_search_id: {newsearch_id}")
-                        #   newsearch[session_id] = FAISS.from_documents(documents=texts, embedding=embeddings)
-    #                       # file_.append(file.split('/')[-1])
-    #   #                     print("Upload successful")
-                      except Exception as e:
-                          print(f"error on {i+1}th file")
-    # #     # Optionally process the files (e.g., save them, etc.)
-                    # Clean up the file after processing
-    
-    
-            if len(newsearch) >= 101:
-                # Remove the first (oldest) inserted item
-                newsearch.popitem(last=False)
-
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        return JsonResponse({'message': "Successful Upload"})
+        for file in files:
+            print("Uploaded file:", file.name)
+        # Parsing, splitting and embedding happen in the background; the client polls upload_status
+        job = ingest.submit(request.user, session_id, files)
+        return JsonResponse({'message': "Upload received", **ingest.status(job)}, status=202)
 
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
 
+@login_required
+def upload_status(request):
+    job = IngestJob.objects.filter(job_id=request.GET.get('job_id', ''), user=request.user).first()
+    if job is None:
+        return JsonResponse({'error': 'Unknown upload job'}, status=404)
+    return JsonResponse(ingest.status(job))
+
+
 
 # chat_history={
 #    "session_id": [],
@@ -1424,7 +1270,6 @@ def upload_files(request):
 def create_new_session(request):
     if request.method == 'POST':
         user_id = request.user.id
-        global session_id
         session_id = str(uuid.uuid4())  # Generate a unique session ID
         # Create a new session record in the database
         new_session = Session.objects.create(user_id=user_id, session_id=session_id)
@@ -1463,10 +1308,240 @@ def retrieve_chat_history(request):
 
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
-chat_history=OrderedDict()
+# Expert chains selectable from the UI, and the router labels that map onto them
+expert_chains={"methodology":methodology_chain,
+               "technical":technical_expert_chain,
+               "project_imp":project_imp_expert_chain,
+               "mel":MEL_expert_chain,
+               "rules":Rules_expert_chain,
+               "communication":Communication_expert_chain}
+
+router_labels={"Methodology":"methodology",
+               "Technical":"technical",
+               "Implementation":"project_imp",
+               "MEL":"mel",
+               "Rules":"rules",
+               "Communication":"communication"}
+
+
+def llm_route_agent(cojoined):
+    pos_agent=prompt_chooser_chain.invoke({"question": cojoined})
+    print(pos_agent)
+    for label, expert in router_labels.items():
+        if label in pos_agent:
+            return expert
+    return "communication"
+
+
+def route_agent(cojoined, question_vector):
+    # The local classifier decides unless it is unsure; then the LLM router does
+    if settings.ROUTER_MODE=="local":
+        chosen=resources.get("agent_router").route(question_vector)
+        if chosen:
+            return chosen
+        print("Local router unsure, asking the LLM router")
+    return llm_route_agent(cojoined)
+
+
+def expand_query(cojoined):
+    """The question followed by the LLM's alternative phrasings of it."""
+    variants=[line.strip() for line in multi_query_chain.invoke({"question": cojoined}).split("\n") if line.strip()]
+    return list(dict.fromkeys([cojoined]+variants))
+
+
+def embed_queries(queries, question_vector):
+    # The question itself is already embedded; the variants go to the model in one batch
+    variants=queries[1:]
+    return [question_vector]+(resources.get("embed_model").embed_documents(variants) if variants else [])
+
+
+def query_vectors_for(question, question_vector):
+    """Vectors to search with: the question's plus those of its expansions (``QUERY_EXPANSION``)."""
+    if settings.QUERY_EXPANSION=="llm":
+        return embed_queries(expand_query(question), question_vector)
+    return expansion.expand(question, question_vector, settings.QUERY_EXPANSION,
+                            docsearch=resources.get("docsearch"), embed_model=resources.get("embed_model"))
+
+
+def search_corpus(query_vectors):
+    return retrieval.search(resources.get("docsearch"), query_vectors, settings.RETRIEVAL_FETCH_K)
+
+
+def search_session(query_vectors, session_id):
+    index=session_index.get(session_id)
+    try:
+        return retrieval.search(index, query_vectors, settings.RETRIEVAL_FETCH_K)
+    except Exception as e:
+        print(e)
+        return []
+
+
+def retrieve_lexical(cojoined):
+    """BM25 candidates from the corpus, or None when hybrid search is off or there is no lexical index."""
+    if not settings.HYBRID_SEARCH:
+        return None
+    index=resources.get("lexical")
+    if index is None:
+        return None
+    return retrieval.lookup(resources.get("docsearch"), index.search(cojoined, settings.HYBRID_LEXICAL_K))
+
+
+def fuse_documents(cojoined, query_vectors, corpus_rankings, lexical_docs, session_rankings):
+    """Fuse the per-query rankings of every index (and the BM25 ranking) and pick the context documents."""
+    rankings=corpus_rankings+([lexical_docs] if lexical_docs else [])+session_rankings
+    pool=fusion.reciprocal_rank_fusion(rankings, key=retrieval.candidate_key, with_scores=True)[:settings.RETRIEVAL_POOL_SIZE]
+    if settings.RELEVANCE_FILTER == "cross_encoder":
+        pool=rerank_pool(cojoined, pool)
+    candidates=[candidate for candidate, _ in pool]
+    scores=[score for _, score in pool]
+    # BM25 hits on an id or acronym from the question are kept even when their embedding is far from it
+    terms=lexical.identifiers(cojoined)
+    exempt={retrieval.candidate_key(candidate) for candidate in lexical_docs or [] if lexical.mentions(candidate[0].page_content, terms)}
+    limit=settings.RETRIEVAL_MAX_DOCS_WITH_UPLOADS if any(session_rankings) else settings.RETRIEVAL_MAX_DOCS
+    documents=retrieval.select(query_vectors[0], candidates, scores, limit, exempt)
+    if settings.RELEVANCE_FILTER == "llm":
+        documents=grade_documents(cojoined, documents)
+    return documents
+
+
+def rerank_pool(cojoined, pool):
+    """The best ``RERANK_TOP_N`` of the fused ``(candidate, score)`` pool by cross-encoder score, with those scores."""
+    try:
+        reranker=resources.get("reranker")
+    except Exception as e:
+        print(f"Reranker unavailable, keeping the fused ranking: {e}")
+        return pool
+    ranked=rerank.rerank(reranker, cojoined, [candidate[0].page_content for candidate, _ in pool],
+                         settings.RERANK_TOP_N, settings.RERANK_MIN_SCORE)
+    return [(pool[i][0], score) for i, score in ranked]
+
+
+def grade_documents(cojoined, documents):
+    rejected=set()
+    for doc in documents:
+      r_grade=retrieval_grader.invoke({"question":cojoined, "document":doc.page_content})
+      if r_grade=='no':
+        rejected.add(fusion.document_key(doc))
+    return [doc for doc in documents if fusion.document_key(doc) not in rejected]
+
+
+def answer_stages(question, session_id, agent, chosen_agent=None):
+    """Stages that turn the standalone ``question`` into the final answer.
+
+    The question is expanded once (``QUERY_EXPANSION``) into query vectors; the
+    corpus and the session uploads are searched with them side by side, next
+    to the BM25 search, the agent router and the MEL reformulation, and every
+    ranking is fused by rank. The final answer and the suggested follow-ups
+    both only need the expert answer. The router stage is left out when
+    ``chosen_agent`` is given.
+    """
+    stages=[
+        pipeline.Stage("query_vectors", lambda question_vector: query_vectors_for(question, question_vector),
+                       deps=["question_vector"]),
+        pipeline.Stage("corpus_rankings", search_corpus, deps=["query_vectors"]),
+        pipeline.Stage("session_rankings", lambda query_vectors: search_session(query_vectors, session_id),
+                       deps=["query_vectors"]),
+        pipeline.Stage("lexical_docs", lambda: retrieve_lexical(question)),
+        pipeline.Stage("documents", lambda query_vectors, corpus_rankings, lexical_docs, session_rankings: fuse_documents(question, query_vectors, corpus_rankings, lexical_docs, session_rankings),
+                       deps=["query_vectors", "corpus_rankings", "lexical_docs", "session_rankings"]),
+        # Nothing relevant enough was found: the experts answer without retrieved context
+        pipeline.Stage("dec_ans", lambda documents: rag_chain.invoke({"question":question, "context":format_con(documents)}) if documents else "",
+                       deps=["documents"]),
+        pipeline.Stage("expert_question", lambda chosen_agent: cojoin_mel_chain.invoke(question) if chosen_agent=="mel" else question,
+                       deps=["chosen_agent"]),
+        pipeline.Stage("ans", lambda chosen_agent, expert_question, dec_ans: expert_chains[chosen_agent].invoke({"question": expert_question, "context":dec_ans}),
+                       deps=["chosen_agent", "expert_question", "dec_ans"]),
+        pipeline.Stage("response", lambda expert_question, dec_ans, ans: final_chain.invoke({"question":expert_question, "context":dec_ans+"\n\n"+ans, "agent":agent}),
+                       deps=["expert_question", "dec_ans", "ans"]),
+        pipeline.Stage("suggested", lambda expert_question, ans: sug.invoke({"question":expert_question, "answer":ans}),
+                       deps=["expert_question", "ans"]),
+    ]
+    if chosen_agent is None:
+        stages.append(pipeline.Stage("chosen_agent", lambda question_vector: route_agent(question, question_vector),
+                                     deps=["question_vector"]))
+    return stages
+
+
+def parse_suggestions(suggested):
+    matches = re.search(r'\[(.*?)\]', suggested, re.DOTALL)
+
+    if matches:
+      suggestive_questions = matches.group(1)
+      suggestive_questions = [i for i in suggestive_questions.split("\n")]
+    #   suggestive_questions= suggestive_questions[:5]
+    else:
+      suggestive_questions = [i for i in suggested.split("\n")]
+    #   suggestive_questions= suggestive_questions[:5]
+    return suggestive_questions
+
+
+def resolve_sources(documents):
+    mapping=resources.get("source_metadata")
+    sources=[]
+    third_sources=[]
+    src_links=[]
+    third_src_links=[]
+    for doc in documents:
+        if doc.metadata["source"].split("/")[-1] in exclude:
+            continue
+        found=source_metadata.lookup(doc.metadata, mapping)
+        if found:
+            ind_src, ind_src_link=found
+            if ind_src not in sources:
+                sources.append(ind_src)
+                src_links.append(ind_src_link)
+        else:
+            ind_src=source_metadata.source_id(doc.metadata["source"])
+            if ind_src not in third_sources:
+                third_sources.append(ind_src)
+                third_src_links.append(" ")
+
+    print (f"Third_sources: {third_sources}")
+    return {'sources': sources, "src_link": src_links, "third_sources": third_sources, "third_src_links": third_src_links}
+
+
+def save_chat(user_id, session_id, agent, question, response, sources, suggestive_questions):
+    with connection.cursor() as cursor:
+      cursor.execute("""
+        INSERT INTO Chat_history (user_id, session_id, agent, message, response, sources, suggestive_question,created_at)
+        VALUES (%s,%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+      """, (user_id, session_id, agent, question, response, '\n\n'.join(sources), '\n\n'.join(suggestive_questions)))
+
+
+def is_greeting(question):
+    return question.lower() in greet_texts
+
+
+def standalone_question(session_id, question):
+    return cojoin_chain.invoke({"chat_history":conversation.get_history(session_id), "user_question":question})
+
 
+def remember_turn(session_id, cojoined, results):
+    if results.get("chosen_agent")=="mel":
+        conversation.append(session_id, cojoined, results["expert_question"])
+    else:
+        conversation.append(session_id, cojoined)
+
+
+def embed_question(cojoined):
+    return resources.get("embed_model").embed_query(cojoined)
+
+
+def cacheable(session_id):
+    # Answers grounded in a session's uploads are specific to that session and never cached
+    return settings.SEMANTIC_CACHE_ENABLED and not session_index.exists(session_id)
 
-# chat_history=[]
+
+def cache_agent(agent):
+    return agent if agent in expert_chains else "none"
+
+
+def initial_results(agent, vector):
+    initial={"question_vector": vector}
+    # An agent picked in the UI replaces the router stage
+    if agent in expert_chains:
+        initial["chosen_agent"]=agent
+    return initial
 
 
 @login_required
@@ -1478,193 +1553,113 @@ def chat_message(request):
         question = request.POST.get('message', '')
         agent = request.POST.get('agent', '')
 
-        for i in greet_texts:
-          if i == question.lower():
+        if is_greeting(question):
             response=greet_r.invoke({"question":question})
             return JsonResponse({'response': response, 'sources': [" ", " "], "suggestive_question": [" ", " "]})
         print("here")
-        try:
-           if chat_history[session_id]:
-              print("chat history exists")
-        except:
-           chat_history[session_id]=[]
-           
-        cojoined=cojoin_chain.invoke({"chat_history":chat_history[session_id], "user_question":question})
+        cojoined=standalone_question(session_id, question)
         
         # print(cojoined)
         # base_q=base_chain.invoke(cojoined)
-        try:
-           if newsearch and newsearch[session_id]:
-                n_retriever=MultiQueryRetriever.from_llm(retriever=newsearch[session_id].as_retriever(search_type='similarity',search_kwargs={'k':3, 'fetch_k':10}), llm=g_llm)
-                retriever=MultiQueryRetriever.from_llm(retriever=docsearch.as_retriever(search_type='similarity',search_kwargs={'k':3, 'fetch_k':10}), llm=g_llm)
-                docs=retriever.invoke(cojoined)
-                n_docs=n_retriever.invoke(cojoined)
-                documents=[]
-                for doc in n_docs:
-                    if doc not in documents:
-                        documents.append(doc)
-                documents=documents[:8]
-                for doc in docs[3:]:
-                    if doc not in documents:
-                        documents.append(doc)
-                documents=documents[:13]
-
-                # print(documents[1])
-           else:
-                print("Error")
-                retriever=MultiQueryRetriever.from_llm(retriever=docsearch.as_retriever(search_type='similarity',search_kwargs={'k':3, 'fetch_k':10}), llm=g_llm)
-                docs=retriever.invoke(cojoined)
-                # print(docs[1])
-                documents=[]
-                for doc in docs:
-                    if doc not in documents:
-                        documents.append(doc)
-                
-                documents=documents[3:11]
-                print("here")
-
-        except Exception as e:
-            print(e)
-            retriever=MultiQueryRetriever.from_llm(retriever=docsearch.as_retriever(search_type='similarity',search_kwargs={'k':3, 'fetch_k':10}), llm=g_llm)
-            docs=retriever.invoke(cojoined)
-            # print(docs[1])
-            documents=[]
-            for doc in docs:
-                if doc not in documents:
-                    documents.append(doc)
-                
-            documents=documents[3:11]
-            print("here")
-
-            # print(documents[1])
-        
-        if len(documents) > 17:
-          for i,j in enumerate(documents):
-            r_temp=documents[i]
-            r_grade=retrieval_grader.invoke({"question":cojoined, "document":r_temp.page_content})
-            if r_grade=='no':
-              documents.remove(r_temp)
-        # print(len(documents))
-        chat_history[session_id].append(cojoined)
-        if len(chat_history[session_id])>10:
-            del chat_history[session_id][0:4]
-        txt=format_con(documents)
-
-        dec_ans=rag_chain.invoke({"question":cojoined, "context":txt})
-        pos_agent=prompt_chooser_chain.invoke({"question": cojoined})
-        print(pos_agent)
-        if agent=="none" or agent==None:
-            if "Methodology" in pos_agent:
-              ans=methodology_chain.invoke({"question": cojoined, "context":dec_ans})
-              print("meth")
-            elif "Technical" in pos_agent:
-              ans=technical_expert_chain.invoke({"question": cojoined, "context":dec_ans})
-              print("tech")
-            elif "Implementation" in pos_agent:
-              ans=project_imp_expert_chain.invoke({"question": cojoined, "context":dec_ans})
-              print("proj")
-            elif "MEL" in pos_agent:
-              cojoined=cojoin_mel_chain.invoke(cojoined)
-              chat_history[session_id].append(cojoined)
-              ans=MEL_expert_chain.invoke({"question": cojoined, "context":dec_ans})
-              print("mel")
-            elif "Rules" in pos_agent:
-              ans=Rules_expert_chain.invoke({"question": cojoined, "context":dec_ans})
-              print("Rules")
-            elif "Communication" in pos_agent:
-              ans=Communication_expert_chain.invoke({"question": cojoined, "context":dec_ans})
-              print("comms")
-        elif agent=="methodology":
-            ans=methodology_chain.invoke({"question": cojoined, "context":dec_ans})
-            print("meth")
-        elif agent=="technical":
-            ans=technical_expert_chain.invoke({"question": cojoined, "context":dec_ans})
-            print("tech")
-        elif agent=="project_imp":
-            ans=project_imp_expert_chain.invoke({"question": cojoined, "context":dec_ans})
-            print("proj")
-        elif agent=="mel":
-            cojoined=cojoin_mel_chain.invoke(cojoined)
-            chat_history[session_id].append(cojoined)
-            ans=MEL_expert_chain.invoke({"question": cojoined, "context":dec_ans})
-            print("mel")
-        elif agent=="rules":
-            ans=Rules_expert_chain.invoke({"question": cojoined, "context":dec_ans})
-            print("Rules")
-        elif agent=="communication":
-            ans=Communication_expert_chain.invoke({"question": cojoined, "context":dec_ans})
-            print("comms")
-
-        ans_comb=dec_ans+"\n\n"+ans
-        response=final_chain.invoke({"question":cojoined, "context":ans_comb, "agent":agent})
+        vector=embed_question(cojoined)
+        cached=semantic_cache.lookup(vector, cache_agent(agent)) if cacheable(session_id) else None
+        if cached:
+            print("semantic cache hit")
+            remember_turn(session_id, cojoined, {})
+            save_chat(user_id, session_id, agent, question, cached["response"], cached["sources"], cached["suggestive_question"])
+            return JsonResponse(cached)
+
+        initial=initial_results(agent, vector)
+        results=pipeline.run(answer_stages(cojoined, session_id, agent, initial.get("chosen_agent")), initial)
+        response=results["response"]
         print("response_gotten")
-        
-        suggested=sug.invoke({"question":cojoined, "answer":ans})
-        
-        matches = re.search(r'\[(.*?)\]', suggested, re.DOTALL)
+        remember_turn(session_id, cojoined, results)
 
-        if matches:
-          suggestive_questions = matches.group(1)
-          suggestive_questions = [i for i in suggestive_questions.split("\n")]
-        #   suggestive_questions= suggestive_questions[:5]
-        else:
-          suggestive_questions = [i for i in suggested.split("\n")]
-        #   suggestive_questions= suggestive_questions[:5]
-
-        src=format_src(documents)
-        # src='PN-AAJ-839.txt\n\nPN-AAF-489.txt\n\nPD-AAU-562.txt\n\nPN-ACL-858.txt\n\nPN-ACL-973.txt\n\nPN-ABS-031.txt\n\nPN-ABM-038.txt\n\nPD-ABX-244.txt\n\nPD-ABX-244.txt\n\nPN-ABI-062.txt\n\nPN-ABP-818.txt\n\nPN-ABK-787.txt\n\nPN-ABG-398.txt\n\nPN-ADS-624.txt\n\nPN-ACE-496.txt'
-        src_= [i for i in src.split("\n\n")]
-        src_init=[]
-        sources=[]
-        third_sources=[]
-        src_links=[]
-        third_src_links=[]
-        for i in src_:
-          if i in src_init:
-            continue
-          else:
-            src_init.append([i])
-            # try:
-            #   # num=re.findall("\d+",i)[0]
-            #   # num=int(i.split(".")[0].strip)
-            try:
-                # print(i)
-                num = re.split(r'\.pdf|\.docx|\.html|\.mp4|\.csv|\.enex|\.pdf|\.txt|\.eml|\.html|\.md|\.mmd|\.epub|\.odt|\.pptx|\.ppt|\.doc|\.docx|\.xlsx|\.xls|\.jpg|\.png|\.srt', i)
-                num=num[0]
-            except Exception as e:
-                num = re.split(r'\.pdf|\.docx|\.html|\.mp4|\.csv|\.enex|\.pdf|\.txt|\.eml|\.html|\.md|\.mmd|\.epub|\.odt|\.pptx|\.ppt|\.doc|\.docx|\.xlsx|\.xls|\.jpg|\.png|\.srt', i)
-                num=num[0]
-                print("reached_except")
-                print(e)
-            
-            try:
-                ind_src=data[data["ID"]==num]["Title"].tolist()[0]
-                ind_src_link=data[data["ID"]==num]["Permalink"].tolist()[0]
-                if ind_src not in sources:
-                    sources.append(ind_src)
-                    src_links.append(ind_src_link)
-            except:
-                ind_src=num.split("\\")[-1]
-                if ind_src not in third_sources:
-                    third_sources.append(ind_src)
-                    third_src_links.append(" ")        
-        
-    
-        with connection.cursor() as cursor:
-          cursor.execute("""
-            INSERT INTO Chat_history (user_id, session_id, agent, message, response, sources, suggestive_question,created_at)
-            VALUES (%s,%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-          """, (user_id, session_id, agent, question, response, '\n\n'.join(sources), '\n\n'.join(suggestive_questions)))
-        
-        print (f"Third_sources: {third_sources}")
-        # print (f"Sources: {sources}")
-        # print (f"Src_links: {src_links}")
-        return JsonResponse({'response': response, 'sources': sources, 'suggestive_question': suggestive_questions, "src_link": src_links
-                             ,"third_sources":third_sources, "third_src_links":third_src_links
-                             })
+        suggestive_questions=parse_suggestions(results["suggested"])
+        source_info=resolve_sources(results["documents"])
+        save_chat(user_id, session_id, agent, question, response, source_info["sources"], suggestive_questions)
+
+        answer={'response': response, 'suggestive_question': suggestive_questions, **source_info}
+        if cacheable(session_id):
+            semantic_cache.store(vector, cache_agent(agent), answer)
+        return JsonResponse(answer)
 
     return JsonResponse({'response': 'Invalid request'}, status=400)
 
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@login_required
+def chat_message_stream(request):
+    """Streaming variant of ``chat_message`` served as Server-Sent Events.
+
+    Emits ``token`` events while ``final_chain`` generates the answer, then
+    ``sources`` and ``suggestions`` once the answer is complete, and ``done``.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'response': 'Invalid request'}, status=400)
+
+    user_id = request.user.id
+    session_id = request.POST.get('sessionId', '')
+    question = request.POST.get('message', '')
+    agent = request.POST.get('agent', '')
+
+    def events():
+        try:
+            if is_greeting(question):
+                for token in greet_r.stream({"question":question}):
+                    yield sse_event("token", token)
+                yield sse_event("done", {})
+                return
+
+            cojoined=standalone_question(session_id, question)
+            vector=embed_question(cojoined)
+            cached=semantic_cache.lookup(vector, cache_agent(agent)) if cacheable(session_id) else None
+            if cached:
+                remember_turn(session_id, cojoined, {})
+                yield sse_event("token", cached["response"])
+                yield sse_event("sources", {key: cached[key] for key in ("sources", "src_link", "third_sources", "third_src_links")})
+                yield sse_event("suggestions", cached["suggestive_question"])
+                save_chat(user_id, session_id, agent, question, cached["response"], cached["sources"], cached["suggestive_question"])
+                yield sse_event("done", {})
+                return
+
+            initial=initial_results(agent, vector)
+            # The answer and the suggestions are produced below, everything else by the graph
+            stages=[stage for stage in answer_stages(cojoined, session_id, agent, initial.get("chosen_agent"))
+                    if stage.name not in ("response", "suggested")]
+            results=pipeline.run(stages, initial)
+            expert_question=results["expert_question"]
+            suggested=pipeline.get_executor().submit(sug.invoke, {"question":expert_question, "answer":results["ans"]})
+
+            parts=[]
+            for token in final_chain.stream({"question":expert_question, "context":results["dec_ans"]+"\n\n"+results["ans"], "agent":agent}):
+                parts.append(token)
+                yield sse_event("token", token)
+            response="".join(parts)
+            remember_turn(session_id, cojoined, results)
+
+            source_info=resolve_sources(results["documents"])
+            yield sse_event("sources", source_info)
+            suggestive_questions=parse_suggestions(suggested.result())
+            yield sse_event("suggestions", suggestive_questions)
+
+            save_chat(user_id, session_id, agent, question, response, source_info["sources"], suggestive_questions)
+            if cacheable(session_id):
+                semantic_cache.store(vector, cache_agent(agent), {'response': response, 'suggestive_question': suggestive_questions, **source_info})
+            yield sse_event("done", {})
+        except Exception as e:
+            print(e)
+            yield sse_event("error", {'response': 'Something went wrong while answering. Please try again.'})
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies (nginx) from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @login_required
 def logout_user(request):
     logout(request)
@@ -1693,7 +1688,19 @@ def soft_delete_chat(request):
 
 @login_required
 def soft_select_chat(request):
-    global session_id
     session_id = request.POST.get('sessionId', '')
     print("Selected session:", session_id)
     return JsonResponse({'status': 'ok', 'sessionId': session_id})
+
+
+# Liveness: the process is up and serving requests
+def healthz(request):
+    return JsonResponse({'status': 'ok', 'ready': resources.is_ready(), 'resources': resources.status(),
+                         'semantic_cache': semantic_cache.stats(), 'conversations': conversation.stats(),
+                         'session_indexes': session_index.stats(), 'ingest_cache': ingest_cache.stats()})
+
+
+# Readiness: every required model and index is loaded, so the worker can take chat traffic
+def readyz(request):
+    ready = resources.is_ready()
+    return JsonResponse({'ready': ready, 'resources': resources.status()}, status=200 if ready else 503)
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatgpt.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+if settings.WARMUP_ON_START:
+    from chat import resources  # noqa: E402
+    resources.start_warmup()
@@ -93,6 +93,22 @@ DATABASES = {
 }
 
 
+# Caches
+# The "conversations" cache holds chat histories shared by all workers; create its table
+# with `python manage.py createcachetable`
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'conversations': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'conversation_cache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -136,3 +152,162 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Models and indexes used by the chat app (loaded lazily by chat/resources.py)
+
+EMBEDDING_MODEL_ID = "Alibaba-NLP/gte-multilingual-base"
+FAISS_INDEX_DIR = BASE_DIR / "faiss_hf"
+SOURCE_METADATA_CSV = BASE_DIR / "chat" / "DECfinder export with permalinks.csv"
+# Compact ID -> (title, permalink) map generated from the CSV by `manage.py build_source_metadata`
+SOURCE_METADATA_MAP = BASE_DIR / "chat" / "source_metadata.json"
+
+# Load every model and index in a background thread when the WSGI/ASGI app starts;
+# /readyz answers 503 until that finishes. Management commands never warm up.
+WARMUP_ON_START = True
+# A resource that failed to load is not retried for RESOURCE_RETRY_SECONDS, doubling after every
+# further failure up to RESOURCE_RETRY_MAX_SECONDS; requests meanwhile get the cached error
+RESOURCE_RETRY_SECONDS = 5
+RESOURCE_RETRY_MAX_SECONDS = 300
+
+# Threads shared by all requests for running independent chat pipeline stages (chat/pipeline.py)
+PIPELINE_MAX_WORKERS = 16
+
+# Semantic answer cache (chat/semantic_cache.py): reuse a stored answer when a new standalone
+# question is at least SEMANTIC_CACHE_THRESHOLD cosine-similar to a previous one
+SEMANTIC_CACHE_ENABLED = True
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_TTL = 60 * 60 * 24
+SEMANTIC_CACHE_MAX_ENTRIES = 2000
+
+# Agent routing (chat/router.py): "local" classifies the question against labelled exemplars
+# and only asks the LLM router when the best agent leads the runner-up by less than
+# ROUTER_MIN_MARGIN cosine similarity; "llm" always uses the LLM router
+ROUTER_MODE = "local"
+ROUTER_MIN_MARGIN = 0.02
+# Optional JSON file of extra {"agent": ["question", ...]} exemplars, e.g. written by
+# `manage.py router_report --save-exemplars`
+ROUTER_EXEMPLARS_FILE = BASE_DIR / "chat" / "router_exemplars.json"
+
+# Conversation histories (chat/conversation.py): shared cache alias (None keeps them per process),
+# lifetime, how long a worker trusts its local copy, and the local LRU bound
+CONVERSATION_CACHE = 'conversations'
+CONVERSATION_TTL = 60 * 60 * 24 * 7
+CONVERSATION_LOCAL_TTL = 5
+CONVERSATION_LOCAL_MAX_SESSIONS = 1000
+CONVERSATION_MAX_TURNS = 10
+
+# Per-session upload indexes (chat/session_index.py): persisted here, and kept in memory
+# up to this many bytes per worker (least recently used sessions are unloaded first)
+SESSION_INDEX_DIR = BASE_DIR / "session_indexes"
+SESSION_INDEX_MEMORY_BYTES = 512 * 1024 * 1024
+
+# Upload ingestion (chat/ingest.py). "worker": jobs are processed by `manage.py ingest_worker`;
+# "thread": jobs run on INGEST_THREADS background threads of the web process
+INGEST_MODE = "worker"
+INGEST_THREADS = 2
+INGEST_DIR = BASE_DIR / "uploaded_files"
+INGEST_POLL_SECONDS = 1
+
+# Bulk embedding (chat/embeddings.py): chunks per model call, and torch intra-op threads
+# (None keeps torch's default of one per physical core)
+EMBED_BATCH_SIZE = 64
+EMBED_TORCH_THREADS = None
+
+# "torch" runs the model with sentence-transformers; "onnx" runs the int8 ONNX export in EMBEDDING_ONNX_DIR
+# (`manage.py export_onnx_embeddings`; check it with `manage.py benchmark_embeddings` before switching)
+EMBEDDING_BACKEND = "torch"
+EMBEDDING_ONNX_DIR = BASE_DIR / "onnx_embedding"
+EMBED_ONNX_THREADS = None
+# Both backends L2-normalise every vector when True, so scores mean the same whichever one built an index.
+# Changing it needs a `build_index` run and an empty SESSION_INDEX_DIR
+EMBEDDING_NORMALIZE = True
+
+# Embedding size (chat/reduction.py): None keeps all 768 dimensions; otherwise "truncate" keeps the leading
+# EMBEDDING_DIM dimensions and "pca" projects with the components in EMBEDDING_PCA_FILE. Changing it needs a
+# `build_index` run and an empty SESSION_INDEX_DIR; compare options first with `manage.py benchmark_reduction`
+EMBEDDING_DIM = None
+EMBEDDING_REDUCTION = "truncate"
+EMBEDDING_PCA_FILE = BASE_DIR / "embedding_pca.npz"
+
+# Shared embedding process (chat/embedding_server.py, `manage.py embedding_server`): set to
+# "unix:/path/to.sock" or "host:port" to have every worker embed through it instead of loading the model.
+# Concurrent calls are batched together for up to EMBED_SERVER_MAX_WAIT_MS
+EMBEDDING_SERVER = None
+EMBED_SERVER_MAX_WAIT_MS = 5
+
+# Parsed chunks and vectors of uploaded files, keyed by content hash (chat/ingest_cache.py)
+INGEST_CACHE_DIR = BASE_DIR / "ingest_cache"
+INGEST_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# Upload parsing (chat/parsing.py): files parsed in parallel child processes, each killed after
+# INGEST_PARSE_TIMEOUT seconds and capped at INGEST_PARSE_MEMORY_MB of address space (None: no cap)
+INGEST_PARSE_PROCESSES = 4
+INGEST_PARSE_TIMEOUT = 300
+INGEST_PARSE_MEMORY_MB = 4096
+
+# Text, CSV, subtitle and PDF uploads up to this size are parsed from memory instead of being written
+# under INGEST_DIR: kept in the web process with INGEST_MODE = "thread", handed to the worker through
+# the database (IngestUpload) with "worker"
+INGEST_MEMORY_MAX_BYTES = 50 * 1024 * 1024
+
+# CSV and Excel uploads are read and embedded this many rows at a time, and written to the session index
+# every INGEST_TABLE_PERSIST_BATCHES batches (each write rewrites the whole index)
+INGEST_TABLE_BATCH_ROWS = 2000
+INGEST_TABLE_PERSIST_BATCHES = 10
+
+# Index type written by `manage.py build_index` for the corpus (chat/ann.py): "flat" (exact),
+# "ivf_flat", "hnsw" or "ivf_pq". nprobe and ef_search are applied when the index is loaded;
+# nlist None means about 4 * sqrt(number of chunks). Compare the options with `manage.py benchmark_index`.
+CORPUS_INDEX_TYPE = "flat"
+# Precision of the vectors in the corpus and session indexes: "float32", "float16" or "int8"
+# (session indexes use float16 instead of int8)
+VECTOR_STORAGE = "float32"
+CORPUS_INDEX_PARAMS = {
+    'nlist': None,
+    'nprobe': 16,
+    'hnsw_m': 32,
+    'ef_construction': 200,
+    'ef_search': 64,
+    'pq_m': 48,
+    'pq_bits': 8,
+}
+
+# Hybrid corpus search: BM25 over lexical.sqlite3 in FAISS_INDEX_DIR (written by `manage.py build_index`)
+# runs beside the dense search, and its ranking is fused with the dense ones
+HYBRID_SEARCH = True
+HYBRID_LEXICAL_K = 10
+
+# Query expansion before retrieval (chat/expansion.py): "llm" (paraphrases from g_llm), or the LLM-free
+# "prf" (pseudo-relevance feedback), "perturb" (embedding perturbation), "paraphrase" (term table) or "none".
+# Compare them with `manage.py benchmark_expansion`
+QUERY_EXPANSION = "llm"
+EXPANSION_VARIANTS = 3
+EXPANSION_PRF_WEIGHT = 0.5
+EXPANSION_NOISE = 0.05
+EXPANSION_PARAPHRASE_FILE = BASE_DIR / "chat" / "paraphrases.json"
+
+# Retrieval (chat/retrieval.py): the question and its expansions each fetch RETRIEVAL_FETCH_K chunks from
+# the corpus and the session uploads; all rankings are fused with reciprocal rank fusion (constant RRF_K)
+# into a pool of RETRIEVAL_POOL_SIZE candidates. Candidates less similar to the question than
+# RETRIEVAL_MIN_SIMILARITY are dropped (none left: no RAG), the rest are cut at the first similarity drop
+# larger than RETRIEVAL_SIMILARITY_CLIFF; BM25 matches on an id or acronym from the question skip both. MMR on the fused scores
+# (RETRIEVAL_MMR_LAMBDA: 1 = relevance only) picks at most RETRIEVAL_MAX_DOCS chunks
+# (RETRIEVAL_MAX_DOCS_WITH_UPLOADS when the uploads matched) for the context
+RETRIEVAL_FETCH_K = 10
+RETRIEVAL_POOL_SIZE = 40
+RETRIEVAL_MIN_SIMILARITY = 0.45
+RETRIEVAL_SIMILARITY_CLIFF = 0.1
+RETRIEVAL_MMR_LAMBDA = 0.7
+RETRIEVAL_MAX_DOCS = 8
+RETRIEVAL_MAX_DOCS_WITH_UPLOADS = 13
+RRF_K = 60
+
+# Relevance filtering (chat/rerank.py): "cross_encoder" scores the whole RETRIEVAL_POOL_SIZE pool against
+# the question in one batch with the local RERANK_MODEL_ID (sentence-transformers, CPU; multilingual like
+# the embeddings), keeps the best RERANK_TOP_N (none scoring below RERANK_MIN_SCORE, a probability, when
+# set) and hands their scores to MMR; "llm" asks the grader LLM about each chunk MMR picked; "none" skips it
+RELEVANCE_FILTER = "cross_encoder"
+RERANK_MODEL_ID = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+RERANK_TOP_N = 20
+RERANK_MIN_SCORE = None